@@ -16,9 +16,19 @@ bl_info = {
 }
 
 
-import bpy, bmesh, struct, os, re, time, math, mathutils, fnmatch, copy
-import xml.etree.ElementTree as ET
+import bpy, bmesh, struct, os, io, re, time, math, mathutils, fnmatch, subprocess, functools
+import numpy as np
+# Prefer lxml's C implementation when it's installed in Blender's Python
+try:
+    import lxml.etree as ET
+    # lxml keeps comments and PIs as children; drop them like the stdlib parser does
+    XML_PARSER = ET.XMLParser(remove_comments=True, remove_pis=True)
+except ImportError:
+    import xml.etree.ElementTree as ET
+    XML_PARSER = None
 from shutil import copyfile
+from collections import deque, Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 from bpy.props import (StringProperty,
                        BoolProperty,
@@ -33,6 +43,105 @@ from bpy.types import (Panel,
                        PropertyGroup,
                        )
 
+# Patterns used to clean up paths and names
+RE_DOUBLE_SEP   = re.compile(r'\\\\|//')
+RE_BACKSLASH    = re.compile(r'\\')
+RE_SOMA_PREFIX  = re.compile(r'.*/SOMA/')
+RE_NONALNUM     = re.compile('[^0-9a-zA-Z]+')
+RE_SOMA_TAIL    = re.compile(r'\\SOMA\\.*')
+RE_ENT_EXT      = re.compile(r'ent$')
+RE_DAE_EXT      = re.compile(r'\.dae$')
+RE_DDS_EXT      = re.compile(r'\.dds$')
+
+# Bake settings saved and restored around an export, grouped by the bake type they belong to
+BAKE_ATTRIBUTES = (
+    ("DIFFUSE", ("use_pass_direct", "use_pass_indirect", "use_pass_color")),
+    ("NORMAL",  ("normal_space", "normal_r", "normal_g", "normal_b")),
+    ("ANY",     ("margin", "use_clear", "use_selected_to_active")),
+)
+
+# Map file section the exporter keeps its objects in
+EXPORT_SECTION_PATH = 'Section[@Name="Blender@HPL3EXPORT"]'
+
+# Constant matrices for converting map object transforms to Y-up
+# Reorder vector columns such that Blender X = HPL Z, Blender Y = HPL X, Blender Z = HPL Y
+COLUMN_REORDER  = mathutils.Matrix(((0,1,0,0), (0,0,1,0), (1,0,0,0), (0,0,0,1)))
+Y_UP            = mathutils.Matrix(((0,-1,0,0), (1,0,0,0), (0,0,1,0), (0,0,0,1)))
+LOCAL_ROT_Y     = mathutils.Matrix.Rotation(math.radians(90.0), 4, 'Y')
+POST            = LOCAL_ROT_Y @ Y_UP
+# Constant matrices for converting mesh transforms on DAE export
+LOCAL_ROTS      = mathutils.Matrix.Rotation(math.radians(-90.0), 4, 'X') @ mathutils.Matrix.Rotation(math.radians(180.0), 4, 'Z')
+PRE_ARM         = mathutils.Matrix.Rotation(math.radians(-90.0), 4, 'Y') @ COLUMN_REORDER
+
+# Format three floats as an HPL3 vector attribute, e.g. FMT3(*obj.scale)
+FMT3 = "{:.5f} {:.5f} {:.5f}".format
+
+
+# ------------------------------------------------------------------------
+#    replace characters HPL3 can't use in file and object names; cached
+#    since the same names come up on every export and panel redraw
+# ------------------------------------------------------------------------
+@functools.lru_cache(maxsize=1024)
+def sanitize_name(name):
+    return RE_NONALNUM.sub('_', name)
+
+
+# ------------------------------------------------------------------------
+#    Deselect every object in one operator call, falling back to a loop
+#    when the operator can't run in the current context
+# ------------------------------------------------------------------------
+def deselect_all():
+    try:
+        bpy.ops.object.select_all(action='DESELECT')
+    except RuntimeError:
+        for ob in bpy.context.selected_objects:
+            ob.select_set(False)
+
+
+# ------------------------------------------------------------------------
+#    Remove datablocks from a bpy.data collection, skipping empty entries,
+#    repeats and datablocks that were already freed
+# ------------------------------------------------------------------------
+def remove_datablocks(collection, datablocks, **kwargs):
+    seen = set()
+    for datablock in datablocks:
+        if datablock is None:
+            continue
+        try:
+            pointer = datablock.as_pointer()
+        except ReferenceError:
+            continue
+        if pointer in seen:
+            continue
+        seen.add(pointer)
+        collection.remove(datablock, **kwargs)
+
+
+# ------------------------------------------------------------------------
+#    Parse an XML file, leaving only element nodes in the tree
+# ------------------------------------------------------------------------
+def read_xml(path):
+    return ET.parse(path, XML_PARSER).getroot()
+
+
+# ------------------------------------------------------------------------
+#    Serialize an XML tree to disk in one buffered write
+# ------------------------------------------------------------------------
+def write_xml(root, path):
+    with open(path, 'wb', buffering=0) as raw, io.BufferedWriter(raw, buffer_size=65536) as buf:
+        ET.ElementTree(root).write(buf)
+
+
+# ------------------------------------------------------------------------
+#    Snap a resolution to the nearest power of two, up to 2^max_bits
+# ------------------------------------------------------------------------
+def snap_pow2(x, max_bits=14):
+    bits = x.bit_length() - 1
+    # Round up once x is past the midpoint in log space, 2^bits * sqrt(2)
+    if x * x > 1 << (2 * bits + 1):
+        bits += 1
+    return 1 << max(min(bits, max_bits), 0)
+
 
 # ------------------------------------------------------------------------
 #    store properties in the active scene
@@ -56,7 +165,7 @@ class HPL3_Export_Properties (PropertyGroup):
 
     def update_map_path(self, context):
         if self["map_file_path"] != "":
-            no_double_slash = re.sub(r'\\\\|//', '', self["map_file_path"])
+            no_double_slash = RE_DOUBLE_SEP.sub('', self["map_file_path"])
             self["map_file_path"] = os.path.abspath(no_double_slash)
 
     map_file_path : StringProperty(
@@ -69,7 +178,7 @@ class HPL3_Export_Properties (PropertyGroup):
         )
 
     def update_entity_path(self, context):
-        no_double_slash = re.sub(r'\\\\|//', '', self["entity_export_path"])
+        no_double_slash = RE_DOUBLE_SEP.sub('', self["entity_export_path"])
         self["entity_export_path"] = os.path.abspath(no_double_slash)
 
     entity_export_path : StringProperty(
@@ -82,7 +191,7 @@ class HPL3_Export_Properties (PropertyGroup):
         )
 
     def update_statobj_path(self, context):
-        no_double_slash = re.sub(r'\\\\|//', '', self["statobj_export_path"])
+        no_double_slash = RE_DOUBLE_SEP.sub('', self["statobj_export_path"])
         self["statobj_export_path"] = os.path.abspath(no_double_slash)
 
     statobj_export_path : StringProperty(
@@ -111,17 +220,13 @@ class HPL3_Export_Properties (PropertyGroup):
         )
 
     def update_res_x_pow2(self, context):
-        base_2 = round(math.log(self["map_res_x"],2))
-        base_2 = max(min(base_2, 14), 0)
-        result = int(math.pow(2, base_2))
+        result = snap_pow2(self["map_res_x"])
         self["map_res_x"] = result
         if self.square_resolution:
           self["map_res_y"] = result
 
     def update_res_y_pow2(self, context):
-        base_2 = round(math.log(self["map_res_y"],2))
-        base_2 = max(min(base_2, 14), 0)
-        result = int(math.pow(2, base_2))
+        result = snap_pow2(self["map_res_y"])
         self["map_res_y"] = result
         if self["square_resolution"]:
           self["map_res_x"] = result
@@ -158,6 +263,15 @@ class HPL3_Export_Properties (PropertyGroup):
         default = False
         )
 
+    bake_device : EnumProperty(
+        name="Bake Device",
+        description="Device Cycles uses to bake textures",
+        items=[ ('GPU', "GPU", "Bake on the GPU if Cycles has one available, otherwise fall back to the CPU"),
+                ('CPU', "CPU", "Always bake on the CPU")
+               ],
+        default = 'GPU'
+        )
+
     sync_blender_deletions : BoolProperty(
         name="Clean Up Missing Objects (Read Description)",
         description="If objects previously exported with this tool exist in the HPL3 map but not the current Blender scene, delete them from the map and disk. Note: Will erase .dds and .dae files even if they have been modified since the last export (.ent and .mat will be left). Protect your work with Git/other version control!",
@@ -198,22 +312,40 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
 
     root = None
     asset_xml = None
+    # Asset tracking entries by lowercased DAEpath
+    asset_by_dae = None
     current_DAE = None
     CONVERTERPATH = None
     main_tool = None
     selected = []
     active_object = None
     export_path = None
+    mesh_export_prefix = None
+    soma_prefix = ""
+    export_timestamp = None
+    gpu_available = None
     dupes = None
     mapgroups = []
     maps = []
     bsdf_sockets = {}
+    map_section = None
+    file_indices = None
+    objects_node = None
+    file_by_path = None
+    obj_by_name = None
+    next_file_id = 0
+    next_obj_id = 0
 
     class ExportError(Exception):
         pass
 
     def __init__(self):
         self.mapgroups = []
+        self.principled_cache = {}
+        self.short_path_cache = {}
+        self.mapgroup_by_matname = {}
+        self.metamesh_by_object = {}
+        self.armature_by_object = {}
 
         # Compatibility for BSDF Principled node changes
         if bpy.app.version >= (4, 0, 0):
@@ -244,15 +376,43 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
         for rpath in spaths:
             tpath = rpath + '\\addons\\nvidia\\nvidia_dds.exe'
             if os.path.exists(tpath):
-                npath = '"' + tpath + '"'
-                return npath
+                return tpath
         return None
 
+    # ------------------------------------------------------------------------
+    #    get the armature deforming a mesh (last armature modifier with a
+    #    target), or None; modifiers are scanned once per object
+    # ------------------------------------------------------------------------
+    def get_armature(self, obj):
+        if obj in self.armature_by_object:
+            return self.armature_by_object[obj]
+        armature = None
+        if obj.type == "MESH":
+            for mod in obj.modifiers:
+                if mod.type == 'ARMATURE':
+                    if mod.object is not None:
+                        armature = mod.object
+        self.armature_by_object[obj] = armature
+        return armature
+
+    # ------------------------------------------------------------------------
+    #    get path of a mesh's exported file with ".../SOMA/" removed
+    #        extension - ".dae" or ".ent"
+    # ------------------------------------------------------------------------
+    def get_short_path(self, mesh_name, extension):
+        key = (mesh_name, extension)
+        short_path = self.short_path_cache.get(key)
+        if short_path is None:
+            filepath = self.mesh_export_prefix + "/" + mesh_name + "/" + mesh_name + extension
+            short_path = RE_SOMA_PREFIX.sub('', filepath)
+            self.short_path_cache[key] = short_path
+        return short_path
+
     # ------------------------------------------------------------------------
     #    make a copy of the data, unless it's linked. Then make it local
     # ------------------------------------------------------------------------
     def make_data_copy(self, data):
-        if (data.library != None):
+        if data.library is not None:
             return data.make_local()
         else:
             return data.copy()
@@ -267,8 +427,15 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
         self.main_tool          = hpl3export
         self.selected           = bpy.context.selected_objects[:]
         self.active_object      = bpy.context.active_object
+        self.export_timestamp   = str(int(time.time()))
         self.export_path    = hpl3export.statobj_export_path if hpl3export.entity_option == 'OP1' else hpl3export.entity_export_path
-        self.export_path    = re.sub(r'\\', '/', os.path.normpath(self.export_path)) + "/"
+        self.export_path    = RE_BACKSLASH.sub('/', os.path.normpath(self.export_path)) + "/"
+        # Normalized once so short paths only need the name appended
+        self.mesh_export_prefix = RE_BACKSLASH.sub('/', os.path.normpath(self.mesh_export_path)).rstrip('/')
+        # Folder that short paths are relative to when deleting files, or
+        # empty if the export path isn't inside SOMA
+        soma_path = RE_SOMA_TAIL.sub('', self.mesh_export_path)
+        self.soma_prefix = soma_path + "\\SOMA\\" if soma_path != self.mesh_export_path else ""
         self.maps = {
             "ROUGHNESS": self.RoughnessMap(self.bsdf_sockets, "Roughness"),
             "PRESPEC": self.PrespecMap(self.bsdf_sockets, "Specular"),
@@ -277,39 +444,65 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
             "DIFFUSE": self.DiffuseMap(self.bsdf_sockets, "Color"),
         }
         # Check that objects were selected
-        if len(self.selected) == 0:
+        if not self.selected:
             if hpl3export.sync_blender_deletions:
                 self.report({'WARNING'}, "No objects selected. Cleaning up unused files")
             else:
                 self.report({'WARNING'}, "No objects selected.")
 
-        exported_mesh_names = []
+        exported_mesh_names = set()
         export_num = 0
 
         # Save original naming and create duplicates
         for ob in self.selected:
-            if ob.type != "MESH" and ob.type != "ARMATURE":
+            ob_type = ob.type
+            if ob_type != "MESH" and ob_type != "ARMATURE":
                 ob.select_set(False)
             else:
-                ob["hpl3export_obj_name"] = re.sub('[^0-9a-zA-Z]+', '_', ob.name)
-                ob["hpl3export_mesh_name"] = re.sub('[^0-9a-zA-Z]+', '_', ob.data.name)
+                ob["hpl3export_obj_name"] = sanitize_name(ob.name)
+                ob["hpl3export_mesh_name"] = sanitize_name(ob.data.name)
                 ob["hpl3export_hide_render"] = str(ob.hide_render)
                 # Set original object as unrenderable in case we are baking lighting
                 ob.hide_render = True
                 # Find all associated armatures and add to list
-                if ob.type == "MESH":
+                if ob_type == "MESH":
                     for mod in ob.modifiers:
                         if mod.type == 'ARMATURE':
                             if mod.object is not None:
                                 mod.object.select_set(True)
-        bpy.ops.object.duplicate(mode='DUMMY')
-        self.dupes = bpy.context.selected_objects[:]
-        # Make the object's data real if it is linked
-        for dupe in self.dupes:
-            if (dupe.data.library != None):
-                dupe.data.make_local()
+        # Duplicate objects and their data into the same collections
+        dupe_of = {}
+        # Copy shared data only once so linked duplicates keep sharing it
+        data_copies = {}
+        for ob in bpy.context.selected_objects:
+            dupe = ob.copy()
+            if ob.data not in data_copies:
+                data_copies[ob.data] = ob.data.copy()
+            dupe.data = data_copies[ob.data]
+            for collection in ob.users_collection:
+                collection.objects.link(dupe)
+            dupe_of[ob] = dupe
+        self.dupes = list(dupe_of.values())
+        for ob, dupe in dupe_of.items():
+            # Point parents, modifiers and constraints at the duplicates
+            if dupe.parent in dupe_of:
+                dupe.parent = dupe_of[dupe.parent]
+            for mod in dupe.modifiers:
+                if getattr(mod, 'object', None) in dupe_of:
+                    mod.object = dupe_of[mod.object]
+            for con in dupe.constraints:
+                if getattr(con, 'target', None) in dupe_of:
+                    con.target = dupe_of[con.target]
+            ob.select_set(False)
+            dupe.select_set(True)
             # Make sure object is renderable for baking
             dupe.hide_render = False
+        if self.active_object in dupe_of:
+            bpy.context.view_layer.objects.active = dupe_of[self.active_object]
+
+        # Deselect all once; each object below only deselects the one before it
+        deselect_all()
+        previous = None
 
         # New export for each object
         if hpl3export.multi_mode == 'MULTI':
@@ -319,13 +512,13 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
                     self.get_asset_xml_entry(current)
                     # Prevent re-exporting files for instanced objects
                     if current.data.name not in exported_mesh_names:
-                        exported_mesh_names.append(current.data.name)
+                        exported_mesh_names.add(current.data.name)
                         if hpl3export.bake_multi_mat_into_single != 'OP3':
-                            # Deselect all and select object
-                            for ob in bpy.context.selected_objects:
-                                ob.select_set(False)
+                            # Deselect previous and select object
+                            if previous is not None:
+                                previous.select_set(False)
                             current.select_set(True)
-                            bpy.context.view_layer.objects.active = current
+                            previous = current
 
                             if hpl3export.bake_multi_mat_into_single == 'OP2':
                                 self.prepare_materials_singletex(hpl3export, current)
@@ -349,12 +542,12 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
                 for current in self.dupes:
                     if current.type == 'MESH':
                         if current.data.name not in exported_mesh_names:
-                            exported_mesh_names.append(current.data.name)
-                            # Deselect all and select object
-                            for ob in bpy.context.selected_objects:
-                                ob.select_set(False)
+                            exported_mesh_names.add(current.data.name)
+                            # Deselect previous and select object
+                            if previous is not None:
+                                previous.select_set(False)
                             current.select_set(True)
-                            bpy.context.view_layer.objects.active = current
+                            previous = current
                             if hpl3export.bake_multi_mat_into_single == 'OP2':
                                 self.prepare_materials_singletex(hpl3export, current)
                             else:
@@ -382,59 +575,40 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
         else:
             is_ent = False
 
-        # Get 'Blender@HPL3EXPORT' section of XML
-        section = None
-        for child in self.root:
-            if child.get("Name") == "Blender@HPL3EXPORT":
-                section = child
-        # or make new
-        if section is None:
-            section = ET.SubElement(self.root, "Section")
-            section.attrib["Name"] = "Blender@HPL3EXPORT"
-            if is_ent:
-                file_indices = ET.SubElement(section, "FileIndex_Entities")
-            else:
-                file_indices = ET.SubElement(section, "FileIndex_StaticObjects")
-            file_indices.attrib["NumOfFiles"] = "0"
-            objects = ET.SubElement(section, "Objects")
-        else:
-            objects = section.find("Objects")
+        # Find map section and index its entries once per export
+        if self.map_section is None:
+            self.ensure_map_section(is_ent)
+        file_indices = self.file_indices
+        objects = self.objects_node
 
         #BEGIN getting variables
 
         # Assemble .dae/ent path
         mesh_name = self.get_custom_property(current_obj, "hpl3export_mesh_name")
+        short_path = self.get_short_path(mesh_name, ".ent" if is_ent else ".dae")
+
         if is_ent:
-            filepath = self.mesh_export_path + "/" + mesh_name + "/" + mesh_name + ".ent"
+            obj_type = "Entity"
         else:
-            filepath = self.mesh_export_path + "/" + mesh_name + "/" + mesh_name + ".dae"
-        filepath = re.sub(r'\\', '/', os.path.normpath(filepath))
-        short_path = re.sub(r'.*\/SOMA\/', '', filepath)
+            obj_type = "StaticObject"
 
         # Find in file index list
-        file_indices = section[0]
         existing_index = None
-        current_idx = None
-        for current_idx in file_indices.iter("File"):
-            # If there is a match, save the index
-            if short_path == current_idx.get("Path"):
-                existing_index = current_idx.get("Id")
-                break
+        existing_file = self.file_by_path.get(short_path)
+        if existing_file is not None:
+            existing_index = existing_file.get("Id")
 
         #self.get_asset_xml_entry(short_path)
 
         # If not in index, make new index and object entry
         if existing_index is None:
             print("Adding new index entry")
-            newindex = ET.Element("File")
-            # If list is entirely empty
-            if current_idx is None:
-                existing_index = 0
-            else:
-                existing_index = int(current_idx.get("Id")) + 1
+            existing_index = self.next_file_id
+            self.next_file_id += 1
+            newindex = ET.SubElement(file_indices, "File")
             newindex.attrib["Id"] = str(existing_index)
             newindex.attrib["Path"] = short_path
-            file_indices.append(newindex)
+            self.file_by_path[short_path] = newindex
             # Increment NumOfFiles
             num_of_files = int(file_indices.attrib['NumOfFiles'])
             file_indices.attrib['NumOfFiles'] = str(num_of_files + 1)
@@ -445,15 +619,6 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
 
 
 
-        # Get last StaticObject ID, set to a num in case no entries exist
-        try:
-            lastID = int(objects[-1].get("ID")) + 1
-        except IndexError:
-            if is_ent:
-                lastID = 268435459
-            else:
-                lastID = 285212672
-
         # Get object name
         object_name = self.get_custom_property(current_obj, "hpl3export_obj_name")
 
@@ -474,49 +639,38 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
         else:
             world_mat = current_obj.matrix_world
 
-        # Reorder vector columns such that Blender X = HPL Z, Blender Y = HPL X, Blender Z = HPL Y
-        column_reorder = mathutils.Matrix(((0,1,0,0), (0,0,1,0), (1,0,0,0), (0,0,0,1)))
-        y_up_mat = mathutils.Matrix(((0,-1,0,0), (1,0,0,0), (0,0,1,0), (0,0,0,1)))
-        local_rot_y = mathutils.Matrix.Rotation(math.radians(90.0), 4, 'Y')
-        new_mat = column_reorder @ world_mat @ local_rot_y @ y_up_mat
+        new_mat = COLUMN_REORDER @ world_mat @ POST
         loc, rot, scale = new_mat.decompose()
         rot = rot.to_euler()
 
-        loc_str = "{:.5f}".format(loc[0]) + " " + "{:.5f}".format(loc[1]) + " " + "{:.5f}".format(loc[2])
-        rot_str = "{:.5f}".format(rot[0]) + " " + "{:.5f}".format(rot[1]) + " " + "{:.5f}".format(rot[2])
-        scale_str = "{:.5f}".format(scale[0])+ " " + "{:.5f}".format(scale[1]) + " " + "{:.5f}".format(scale[2])
+        loc_str = FMT3(*loc)
+        rot_str = FMT3(*rot)
+        scale_str = FMT3(*scale)
 
         #END getting variables
 
         # Search for existing entry
         old_mod_time = 0
-        created_new = 0
-        newobj = None
+        newobj = self.obj_by_name.get(object_name)
         # If entry exists, update
-        if is_ent:
-            obj_type = "Entity"
-        else:
-            obj_type = "StaticObject"
-        for obj in objects.iter(obj_type):
-            if object_name == obj.get("Name"):
-                try:
-                    old_mod_time = int(obj.get("ModStamp"))
-                except ValueError:
-                    old_mod_time = 0
-                newobj = obj
-                break
+        if newobj is not None:
+            try:
+                old_mod_time = int(newobj.get("ModStamp"))
+            except ValueError:
+                old_mod_time = 0
 
         # If does not exist, make new
         if newobj is None:
             # Create new XML element
-            newobj = ET.Element(obj_type)
-            newobj.attrib["ID"] = str(lastID)
-            newobj.attrib["CreStamp"] = str(int(time.time()))
-            created_new = 1
+            newobj = ET.SubElement(objects, obj_type)
+            newobj.attrib["ID"] = str(self.next_obj_id)
+            newobj.attrib["CreStamp"] = self.export_timestamp
+            self.next_obj_id += 1
+            self.obj_by_name[object_name] = newobj
 
 
         newobj.attrib["Name"] = object_name
-        newobj.attrib["ModStamp"] = str(int(time.time()))
+        newobj.attrib["ModStamp"] = self.export_timestamp
         newobj.attrib["WorldPos"] = loc_str
         newobj.attrib["Rotation"] = rot_str
         newobj.attrib["Scale"] = scale_str
@@ -567,11 +721,53 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
             else:
                 var.attrib["Value"] = "false"
 
-        if created_new:
-            objects.append(newobj)
-
         return old_mod_time
 
+    # ------------------------------------------------------------------------
+    #    find (or create) the 'Blender@HPL3EXPORT' section of the map file
+    #    and cache it along with its file index and object list
+    # ------------------------------------------------------------------------
+    def ensure_map_section(self, is_ent):
+        section = self.root.find(EXPORT_SECTION_PATH)
+        # or make new
+        if section is None:
+            section = ET.SubElement(self.root, "Section")
+            section.attrib["Name"] = "Blender@HPL3EXPORT"
+            if is_ent:
+                file_indices = ET.SubElement(section, "FileIndex_Entities")
+            else:
+                file_indices = ET.SubElement(section, "FileIndex_StaticObjects")
+            file_indices.attrib["NumOfFiles"] = "0"
+            ET.SubElement(section, "Objects")
+        self.map_section = section
+        self.file_indices = section[0]
+        self.objects_node = section.find("Objects")
+        self.build_xml_indices(section, "Entity" if is_ent else "StaticObject", is_ent)
+
+    # ------------------------------------------------------------------------
+    #    index the 'Blender@HPL3EXPORT' section so add_object doesn't rescan it
+    #        section - map XML section holding the file index and objects
+    # ------------------------------------------------------------------------
+    def build_xml_indices(self, section, obj_type, is_ent):
+        self.file_by_path = {}
+        self.next_file_id = 0
+        for file in section[0].iter("File"):
+            self.file_by_path.setdefault(file.get("Path"), file)
+            self.next_file_id = int(file.get("Id")) + 1
+
+        objects = section.find("Objects")
+        self.obj_by_name = {}
+        for obj in objects.iter(obj_type):
+            self.obj_by_name.setdefault(obj.get("Name"), obj)
+
+        # Continue from last object ID, set to a num in case no entries exist
+        if len(objects):
+            self.next_obj_id = int(objects[-1].get("ID")) + 1
+        elif is_ent:
+            self.next_obj_id = 268435459
+        else:
+            self.next_obj_id = 285212672
+
     # ------------------------------------------------------------------------
     #    find (or create) an entry in the script's asset tracking xml file
     #        short_path - path to file with ".../SOMA/" removed
@@ -579,21 +775,24 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
     def get_asset_xml_entry(self, object):
         # Build filepath
         mesh_name = self.get_custom_property(object, "hpl3export_mesh_name")
-        filepath = self.mesh_export_path + "/" + mesh_name + "/" + mesh_name + ".dae"
-        filepath = re.sub(r'\\', '/', os.path.normpath(filepath))
-        short_path = re.sub(r'.*\/SOMA\/', '', filepath)
+        short_path = self.get_short_path(mesh_name, ".dae")
         # Find asset path in asset XML list
-        asset_listed = 0
-        for asset in self.asset_xml.iter("Asset"):
-            if short_path == asset.get("DAEpath"):
-                asset_listed = 1
-                self.current_DAE = asset
-                break
-        if not asset_listed:
+        self.current_DAE = self.asset_by_dae.get(short_path.lower())
+        if self.current_DAE is None:
         # If asset not listed, save asset path to asset tracking xml list
             self.current_DAE = ET.SubElement(self.asset_xml, "Asset")
             self.current_DAE.attrib["DAEpath"] = short_path
             self.current_DAE.attrib["Uses"] = "0"
+            self.asset_by_dae[short_path.lower()] = self.current_DAE
+
+    # ------------------------------------------------------------------------
+    #    remove an entry from the asset tracking xml file and its index
+    # ------------------------------------------------------------------------
+    def retire_asset(self, asset):
+        self.asset_xml.remove(asset)
+        key = asset.get("DAEpath", "").lower()
+        if self.asset_by_dae.get(key) is asset:
+            del self.asset_by_dae[key]
 
     def get_custom_property(self, object, prop):
         # Name fallback in case object is an empty, which is allowed
@@ -604,82 +803,111 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
         return result
 
     class MetaMaterial:
-        original        = None
-        material        = None
-        principled_node = None
+        __slots__ = ('original', 'material', 'principled_node', 'sockets', 'image_nodes')
+        def __init__(self):
+            self.original        = None
+            self.material        = None
+            self.principled_node = None
+            self.sockets         = {}
+            # HPL3EXPORT image texture nodes by map type, kept for every bake pass
+            self.image_nodes     = {}
+        # Keep the BSDF's input sockets by name so bake steps skip the RNA lookup
+        def set_principled_node(self, node, bsdf_sockets):
+            self.principled_node = node
+            self.sockets = {name: node.inputs[name] for name in bsdf_sockets.values()}
 
     class MetaImage:
-        image = None
-        temp_path = ""
-        temp_image = ""
-        microimage = None
-        is_microimage = False
-        bsdf_sockets = None
-        socket_name = None
+        __slots__ = ('image', 'temp_path', 'temp_image', 'microimage', 'is_microimage', 'bsdf_sockets', 'socket_key', 'socket_name', 'exportable')
         def __init__(self, bsdf_sockets, socket_name):
+            self.image = None
+            # Per instance, as a mapgroup can turn off exporting one of its maps
+            self.exportable = self.exportable_default
+            self.temp_path = ""
+            self.temp_image = ""
+            self.microimage = None
+            self.is_microimage = False
             self.bsdf_sockets = bsdf_sockets
+            self.socket_key = socket_name
             self.socket_name = bsdf_sockets[socket_name]
+        # Fresh instance of the same map type, with no images assigned yet
+        def clone(self):
+            return self.__class__(self.bsdf_sockets, self.socket_key)
 
     class MetaMesh:
-        object = None
-        mesh_original = None
-        mesh_with_reset_uvs = None
-        mesh_with_applied_modifiers = None
+        __slots__ = ('object', 'mesh_original', 'mesh_with_reset_uvs', 'mesh_with_applied_modifiers')
         def __init__(self, object):
             self.object = object
             self.mesh_original = object.data
+            self.mesh_with_reset_uvs = None
+            self.mesh_with_applied_modifiers = None
 
         def make_data_copy(self, data):
-            if (data.library != None):
+            if data.library is not None:
                 return data.make_local()
             else:
                 return data.copy()
 
         def create_mesh_with_reset_uvs(self):
-            current_mesh_name = self.object.data.name
-            new_mesh = self.make_data_copy(self.object.data)
+            new_mesh = self.make_data_copy(self.mesh_original)
             uv_layers = new_mesh.uv_layers
-            old_uv_idx = -1
-            uv_names = []
-            for idx, layer in enumerate(uv_layers):
-                uv_names.append(layer.name)
-                if layer.active_render == True:
-                    old_uv_idx = idx
-            for i in range(0, len(uv_layers)):
-                uv_layers.remove(uv_layers[0])
-            for name in uv_names:
-                uv_layers.new(name=name)
-            uv_layers[old_uv_idx].active = True
-            uv_layers[old_uv_idx].active_render = True
+            if uv_layers:
+                reset_uvs = self.get_reset_uvs(new_mesh)
+                for layer in uv_layers:
+                    layer.data.foreach_set("uv", reset_uvs)
             self.mesh_with_reset_uvs = new_mesh
 
+        # Same layout Blender gives a freshly added UV layer: tris and quads
+        # fill the unit square, ngons are spread around a circle
+        def get_reset_uvs(self, mesh):
+            num_polys = len(mesh.polygons)
+            loop_starts = np.empty(num_polys, dtype=np.int32)
+            loop_totals = np.empty(num_polys, dtype=np.int32)
+            mesh.polygons.foreach_get("loop_start", loop_starts)
+            mesh.polygons.foreach_get("loop_total", loop_totals)
+            # Corner number and face size for every loop, in polygon order
+            offsets = np.cumsum(loop_totals) - loop_totals
+            corners = np.arange(loop_totals.sum()) - np.repeat(offsets, loop_totals)
+            sizes = np.repeat(loop_totals, loop_totals)
+            angles = corners * (2.0 * math.pi) / sizes
+            face_uvs = np.empty((len(corners), 2), dtype=np.float32)
+            face_uvs[:, 0] = 0.5 * np.sin(angles) + 0.5
+            face_uvs[:, 1] = 0.5 * np.cos(angles) + 0.5
+            is_quad = sizes == 4
+            face_uvs[is_quad] = np.array(((0,0), (1,0), (1,1), (0,1)), dtype=np.float32)[corners[is_quad]]
+            is_tri = sizes == 3
+            face_uvs[is_tri] = np.array(((0,0), (1,0), (1,1)), dtype=np.float32)[corners[is_tri]]
+            # Scatter into mesh loop order
+            uvs = np.empty((len(mesh.loops), 2), dtype=np.float32)
+            uvs[np.repeat(loop_starts, loop_totals) + corners] = face_uvs
+            return uvs.ravel()
+
     class MapGroup:
-        metaimages  = {}
-        metamats    = []
-        metameshes      = []
-        mat_paths   = []
+        __slots__ = ('metaimages', 'metamats', 'metameshes', 'mat_paths', 'metamat_by_name', 'export_paths')
         def __init__(self):
             self.metaimages = {}
             self.metamats   = []
             self.metameshes    = []
             self.mat_paths = []
+            self.metamat_by_name = {}
+            # Full export paths by object pointer, see get_full_export_path
+            self.export_paths = {}
         def prepare_pre_bake(self, mapname):
             for metamat in self.metamats:
                 node_tree = metamat.material.node_tree
-                image_node = node_tree.nodes["HPL3EXPORT_" + mapname]
+                image_node = metamat.image_nodes[mapname]
                 self.metaimages[mapname].pre_bake(metamat, node_tree, image_node)
                 node_tree.nodes.active = image_node
         def prepare_post_bake(self, mapname):
             for metamat in self.metamats:
                 node_tree = metamat.material.node_tree
-                image_node = node_tree.nodes["HPL3EXPORT_" + mapname]
+                image_node = metamat.image_nodes[mapname]
                 self.metaimages[mapname].post_bake(metamat, node_tree, image_node)
                 node_tree.nodes.active = None
 
         def special_bake(self, mapname):
             metamat = self.metamats[0]
             node_tree = metamat.material.node_tree
-            image_node = node_tree.nodes["HPL3EXPORT_" + mapname]
+            image_node = metamat.image_nodes[mapname]
             self.metaimages[mapname].bake(self, metamat, node_tree, image_node)
 
     def prepare_materials_singletex(self, hpl3export, current_obj):
@@ -689,56 +917,52 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
         if metamesh not in mapgroup.metameshes:
             mapgroup.metameshes.append(metamesh)
         mesh_name = current_obj["hpl3export_mesh_name"]
-        if len(current_obj.material_slots) == 0:
-            bpy.ops.object.material_slot_add()
+        if not current_obj.material_slots:
+            current_obj.data.materials.append(None)
         for idx,slot in enumerate(current_obj.material_slots):
             if slot.material is None:
                 self.set_slot_to_default_material_singletex(mesh_name, current_obj, mapgroup, slot)
                 continue
             # if temp material isn't in current mapgroup
             temp_mat_name = "hpl3export_" + mesh_name + "_" + slot.material.name
-            metamat = None
-            for existing in mapgroup.metamats:
-                if existing.material.name == temp_mat_name:
-                    metamat = existing
+            metamat = mapgroup.metamat_by_name.get(temp_mat_name)
             if metamat is None:
                 metamat = self.MetaMaterial()
                 metamat.original = slot.material
                 # If material isn't valid, make new
-                if self.get_principled_node(slot.material) is None:
+                pn = self.get_principled_node(slot.material)
+                if pn is None:
                     metamat.material = self.make_valid_material(slot.material, temp_mat_name)
+                    metamat.set_principled_node(self.get_principled_node(metamat.material), self.bsdf_sockets)
                 else:
-                    # Make a copy
+                    # Make a copy, node names carry over
                     metamat.material = self.make_data_copy(slot.material)
                     metamat.material.name = temp_mat_name
-                metamat.principled_node = self.get_principled_node(metamat.material)
-                self.prepare_principled_node(metamat.principled_node)
+                    metamat.set_principled_node(metamat.material.node_tree.nodes[pn.name], self.bsdf_sockets)
+                self.prepare_principled_node(metamat)
                 # Add material to mapgroup
                 mapgroup.metamats.append(metamat)
+                mapgroup.metamat_by_name[temp_mat_name] = metamat
             slot.material = metamat.material
 
         self.create_mapgroup_maps(hpl3export, mapgroup, self.get_export_dir(hpl3export, mesh_name), mesh_name)
-        if len(current_obj.data.uv_layers) == 0:
-            new_uv = uv_layers.new()
+        if not current_obj.data.uv_layers:
+            new_uv = current_obj.data.uv_layers.new()
             self.smart_project_uvs(current_obj)
         else:
             self.create_single_uv_map(hpl3export, current_obj)
-        metamesh.create_mesh_with_reset_uvs()
         return
 
 
 
     def prepare_materials_multitex(self, hpl3export, current_obj):
         mapgroup = None
-        metamesh = None
-        for mg in self.mapgroups:
-            for existing in mg.metameshes:
-                if current_obj == existing.object:
-                    metamesh = existing
+        metamesh = self.metamesh_by_object.get(current_obj)
         if metamesh is None:
             metamesh = self.MetaMesh(current_obj)
-        if len(current_obj.material_slots) == 0:
-            bpy.ops.object.material_slot_add()
+            self.metamesh_by_object[current_obj] = metamesh
+        if not current_obj.material_slots:
+            current_obj.data.materials.append(None)
         for idx,slot in enumerate(current_obj.material_slots):
             if slot.material is None:
                 self.set_slot_to_default_material_multitex(hpl3export, current_obj, slot, metamesh)
@@ -746,61 +970,74 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
             # if temp material isn't in current mapgroup
             temp_mat_name = "hpl3export_" + slot.material.name
             metamat = None
-            for existing in self.mapgroups:
-                if existing.metamats[0].material.name == temp_mat_name:
-                    mapgroup = existing
-                    metamat = existing.metamats[0]
+            mapgroup = self.mapgroup_by_matname.get(temp_mat_name)
+            if mapgroup is not None:
+                metamat = mapgroup.metamats[0]
             if metamat is None:
                 mapgroup = self.MapGroup()
                 self.mapgroups.append(mapgroup)
+                self.mapgroup_by_matname[temp_mat_name] = mapgroup
                 metamat = self.MetaMaterial()
                 metamat.original = slot.material
                 # If material isn't valid, make new
-                if self.get_principled_node(slot.material) is None:
+                pn = self.get_principled_node(slot.material)
+                if pn is None:
                     metamat.material = self.make_valid_material(slot.material, temp_mat_name)
+                    metamat.set_principled_node(self.get_principled_node(metamat.material), self.bsdf_sockets)
                 else:
-                    # Make a copy
+                    # Make a copy, node names carry over
                     metamat.material = self.make_data_copy(slot.material)
                     metamat.material.name = temp_mat_name
-                metamat.principled_node = self.get_principled_node(metamat.material)
+                    metamat.set_principled_node(metamat.material.node_tree.nodes[pn.name], self.bsdf_sockets)
                 # Add material to mapgroup
-                self.prepare_principled_node(metamat.principled_node)
+                self.prepare_principled_node(metamat)
                 mapgroup.metamats.append(metamat)
                 mesh_name = current_obj["hpl3export_mesh_name"]
                 self.create_mapgroup_maps(hpl3export, mapgroup, self.get_export_dir(hpl3export, mesh_name), temp_mat_name)
             slot.material = metamat.material
             if metamesh not in mapgroup.metameshes:
                 mapgroup.metameshes.append(metamesh)
-        if len(current_obj.data.uv_layers) == 0:
+        if not current_obj.data.uv_layers:
             new_uv = current_obj.data.uv_layers.new()
             self.smart_project_uvs(current_obj)
-        metamesh.create_mesh_with_reset_uvs()
         return
 
     def get_principled_node(self, mat):
+        # Cached per material, including materials without one
+        key = mat.as_pointer()
+        if key in self.principled_cache:
+            return self.principled_cache[key]
         # Find Principled node
+        result = None
         if mat.use_nodes:
             if mat.node_tree is not None:
                 for node in mat.node_tree.nodes:
                     if (node.type == 'BSDF_PRINCIPLED'):
-                        return node
-        return None
+                        result = node
+                        break
+        self.principled_cache[key] = result
+        return result
 
-    def prepare_principled_node(self, node):
-        node.inputs[self.bsdf_sockets["Metallic"]].default_value = 0
-        node.inputs[self.bsdf_sockets["Transmission"]].default_value = 0
+    def prepare_principled_node(self, metamat):
+        # Only write sockets that aren't already zero, each write tags the material for update
+        for socket_key in ("Metallic", "Transmission"):
+            socket = metamat.sockets[self.bsdf_sockets[socket_key]]
+            if socket.default_value != 0:
+                socket.default_value = 0
         return
 
     def make_valid_material(self, original, temp_mat_name):
         mat = bpy.data.materials.new(temp_mat_name)
         mat.use_nodes = True
         principled_name = "Principled BSDF"
+        principled_node = mat.node_tree.nodes[principled_name]
         # Copy base, spec, and roughness
-        mat.node_tree.nodes[principled_name].inputs[self.bsdf_sockets["Color"]].default_value = (
+        principled_node.inputs[self.bsdf_sockets["Color"]].default_value = (
             original.diffuse_color[0], original.diffuse_color[1], original.diffuse_color[2], 1
         )
-        mat.node_tree.nodes[principled_name].inputs[self.bsdf_sockets["Specular"]].default_value = original.specular_intensity
-        mat.node_tree.nodes[principled_name].inputs[self.bsdf_sockets["Roughness"]].default_value = original.roughness
+        principled_node.inputs[self.bsdf_sockets["Specular"]].default_value = original.specular_intensity
+        principled_node.inputs[self.bsdf_sockets["Roughness"]].default_value = original.roughness
+        self.principled_cache[mat.as_pointer()] = principled_node
         return mat
 
 
@@ -814,25 +1051,27 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
         default_metamat = self.MetaMaterial()
         default_metamat.original = mat
         default_metamat.material = mat
-        default_metamat.principled_node = mat.node_tree.nodes["Principled BSDF"]
+        default_metamat.set_principled_node(mat.node_tree.nodes["Principled BSDF"], self.bsdf_sockets)
         return default_metamat
 
     def set_slot_to_default_material_singletex(self, mesh_name, current_obj, mapgroup, slot):
         default_mat_name = "hpl3export_" + mesh_name + "_default"
-        default_metamat = self.add_basic_material(current_obj, default_mat_name)
-        mapgroup.metamats.append(default_metamat)
+        default_metamat = mapgroup.metamat_by_name.get(default_mat_name)
+        if default_metamat is None:
+            default_metamat = self.add_basic_material(current_obj, default_mat_name)
+            mapgroup.metamats.append(default_metamat)
+            mapgroup.metamat_by_name[default_mat_name] = default_metamat
         slot.material = default_metamat.material
 
     def set_slot_to_default_material_multitex(self, hpl3export, current_obj, slot, metamesh):
-        mapgroup = None
         default_mat_name = "hpl3export_default"
-        for idx_mapgroup in self.mapgroups:
-            if idx_mapgroup.metamats[0].material.name == default_mat_name:
-                mapgroup = idx_mapgroup
-                default_metamat = self.add_basic_material(current_obj, default_mat_name)
-        if mapgroup is None:
+        mapgroup = self.mapgroup_by_matname.get(default_mat_name)
+        if mapgroup is not None:
+            default_metamat = mapgroup.metamats[0]
+        else:
             mapgroup = self.MapGroup()
             self.mapgroups.append(mapgroup)
+            self.mapgroup_by_matname[default_mat_name] = mapgroup
             default_metamat = self.add_basic_material(current_obj, default_mat_name)
             mapgroup.metamats.append(default_metamat)
             self.create_mapgroup_maps(hpl3export, mapgroup, self.get_export_dir(hpl3export, current_obj["hpl3export_mesh_name"]), default_mat_name)
@@ -855,9 +1094,13 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
         return
 
     def smart_project_uvs(self, current_obj):
+        # Unwrapping works through the active object
+        bpy.context.view_layer.objects.active = current_obj
         if bpy.app.version >= (2, 91, 0):
-            for poly in current_obj.data.polygons:
-                poly.select = True
+            # Select everything so edit mode unwraps the whole mesh
+            mesh = current_obj.data
+            for elements in (mesh.vertices, mesh.edges, mesh.polygons):
+                elements.foreach_set("select", np.ones(len(elements), dtype=bool))
             bpy.ops.object.mode_set(mode='EDIT')
             bpy.ops.uv.smart_project(angle_limit=math.radians(70.0), island_margin = 0.002, correct_aspect=False, scale_to_bounds=False)
             bpy.ops.object.mode_set(mode='OBJECT')
@@ -865,53 +1108,57 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
             bpy.ops.uv.smart_project(angle_limit=85.0, island_margin = 0.02, use_aspect=False, stretch_to_bounds=False)
 
     def create_mapgroup_maps(self, hpl3export, mapgroup, export_dir, base_name):
-        # Find if normal map is used
-        using_nmap = False
+        # Size every BSDF socket the maps read from in one pass over the materials,
+        # maps sharing a socket share the result
+        socket_res = {}
+        for map in self.maps.values():
+            socket_res[map.socket_name] = [0, 0, False]
         for metamat in mapgroup.metamats:
-            if metamat.principled_node.inputs[self.bsdf_sockets["Normal"]].is_linked:
-                using_nmap = True
+            for socket_name, res in socket_res.items():
+                result_x, result_y, _socket_linked = self.get_optimal_image_size(hpl3export, metamat.sockets[socket_name])
+                res[0] = max(result_x, res[0])
+                res[1] = max(result_y, res[1])
+                if _socket_linked:
+                    res[2] = True
+        # Find if normal map is used
+        using_nmap = socket_res[self.bsdf_sockets["Normal"]][2]
+        temp_path = export_dir + sanitize_name(base_name)
+        images = bpy.data.images
+        bake_mode = hpl3export.bake_multi_mat_into_single
+        multi_mat = len(mapgroup.metamats) > 1
+        full_res_x, full_res_y = hpl3export.map_res_x, hpl3export.map_res_y
         # Make maps
         for maptype, map in self.maps.items():
-            mi = copy.deepcopy(map)
+            mi = map.clone()
             if maptype == "NORMAL" and not using_nmap:
                 # Skip if single export, otherwise make one and just don't export it
-                if hpl3export.bake_multi_mat_into_single == 'OP2':
+                if bake_mode == 'OP2':
                     continue
                 else:
                     mi.exportable = False
-            res_x = res_y = 0
-            socket_linked = False
-            for metamat in mapgroup.metamats:
-                result_x, result_y, _socket_linked = self.get_optimal_image_size(hpl3export, metamat.principled_node.inputs[map.socket_name])
-                res_x = max(result_x, res_x)
-                res_y = max(result_y, res_y)
-                if _socket_linked:
-                    socket_linked = True
+            res_x, res_y, socket_linked = socket_res[map.socket_name]
             # Single texture
-            requires_full_res = socket_linked or len(mapgroup.metamats) > 1 or hpl3export.bake_scene_lighting
-            if (hpl3export.bake_multi_mat_into_single == 'OP2' and requires_full_res):
-                res_x = hpl3export.map_res_x
-                res_y = hpl3export.map_res_y
+            if bake_mode == 'OP2' and (socket_linked or multi_mat or hpl3export.bake_scene_lighting):
+                res_x, res_y = full_res_x, full_res_y
             # Multi texture
-            requires_full_res = hpl3export.bake_scene_lighting
-            if (hpl3export.bake_multi_mat_into_single == 'OP1' and requires_full_res):
-                res_x = hpl3export.map_res_x
-                res_y = hpl3export.map_res_y
+            elif bake_mode == 'OP1' and hpl3export.bake_scene_lighting:
+                res_x, res_y = full_res_x, full_res_y
             map_res_x = int(res_x/2) if maptype in ('ROUGHNESS', 'PRESPEC') else res_x
             map_res_y = int(res_y/2) if maptype in ('ROUGHNESS', 'PRESPEC') else res_y
-            bpy.ops.image.new(name=base_name + "_" + maptype, width=map_res_x, height=map_res_y)
-            mi.image = bpy.context.blend_data.images[base_name + "_" + maptype]
+            mi.image = images.new(name=base_name + "_" + maptype, width=map_res_x, height=map_res_y, alpha=True)
             mi.is_microimage = map_res_x < 32 or map_res_y < 32
             if not hpl3export.disable_small_texture_workaround:
-                bpy.ops.image.new(name=base_name + "_" + maptype + "_micro", width=4, height=4)
-                mi.microimage = bpy.context.blend_data.images[base_name + "_" + maptype + "_micro"]
-            mi.temp_path = export_dir + re.sub('[^0-9a-zA-Z]+', '_', base_name)
+                mi.microimage = images.new(name=base_name + "_" + maptype + "_micro", width=4, height=4, alpha=True)
+            mi.temp_path = temp_path
             mapgroup.metaimages[maptype] = mi
             # Add image texture node to mapgroup materials
+            node_name = "HPL3EXPORT_" + maptype
+            image = mi.image
             for metamat in mapgroup.metamats:
                 img_node = metamat.material.node_tree.nodes.new("ShaderNodeTexImage")
-                img_node.name = "HPL3EXPORT_" + maptype
-                img_node.image = mi.image
+                img_node.name = node_name
+                img_node.image = image
+                metamat.image_nodes[maptype] = img_node
         return
 
     # ------------------------------------------------------------------------
@@ -924,31 +1171,31 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
             return 4, 4, False
         # set resolution to same as source
         # traverse socket subtree to find max res in image nodes
-        subtree_nodes = [socket.links[0].from_node]
-        node_list = []
-        while len(subtree_nodes) != 0:
-            for input in subtree_nodes[0].inputs:
-                if (input.is_linked):
-                    # Will have duplicates but will include all in subtree
-                    subtree_nodes.append(input.links[0].from_node)
-            node_list.append(subtree_nodes[0])
-            subtree_nodes.pop(0)
+        subtree_nodes = deque([socket.links[0].from_node])
+        seen = {subtree_nodes[0].as_pointer()}
         max_res_x = max_res_y = 0
-        for node in node_list:
-            if (type(node) == bpy.types.ShaderNodeTexImage):
-                if(node.image is not None):
-                    max_res_x = max(node.image.size[0], max_res_x)
-                    max_res_y = max(node.image.size[1], max_res_y)
+        while subtree_nodes:
+            cur = subtree_nodes.popleft()
+            for input in cur.inputs:
+                if (input.is_linked):
+                    # Queue each node once, even if several inputs share it
+                    from_node = input.links[0].from_node
+                    key = from_node.as_pointer()
+                    if key not in seen:
+                        seen.add(key)
+                        subtree_nodes.append(from_node)
+            # Track the largest image as we go
+            if (type(cur) == bpy.types.ShaderNodeTexImage):
+                if(cur.image is not None):
+                    size_x, size_y = cur.image.size
+                    max_res_x = max(size_x, max_res_x)
+                    max_res_y = max(size_y, max_res_y)
         if max_res_x != 0 and max_res_y != 0:
-            base_2 = round(math.log(max_res_x,2))
-            base_2 = max(min(base_2, 14), 0)
-            max_res_x = int(math.pow(2, base_2))
+            max_res_x = snap_pow2(max_res_x)
             # Limit to max bake size x
             max_res_x = min(max_res_x, hpl3export.map_res_x)
 
-            base_2 = round(math.log(max_res_y,2))
-            base_2 = max(min(base_2, 14), 0)
-            max_res_y = int(math.pow(2, base_2))
+            max_res_y = snap_pow2(max_res_y)
             # Limit to max bake size y
             max_res_y = min(max_res_y, hpl3export.map_res_y)
         else:
@@ -958,9 +1205,10 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
 
 
     class RoughnessMap(MetaImage):
+        __slots__           = ()
         name                = "ROUGHNESS"
         suffix              = "_rough"
-        exportable          = False
+        exportable_default  = False
         special_bake_func   = False
         bake_using_diffuse  = False
         def pre_bake(self, metamat, node_tree, image_node):
@@ -969,15 +1217,16 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
             print(self.name + " map post-bake")
 
     class PrespecMap(MetaImage):
+        __slots__           = ()
         name                = "PRESPEC"
         suffix              = "_prespec"
-        exportable          = False
+        exportable_default  = False
         special_bake_func   = False
         bake_using_diffuse  = True
         def pre_bake(self, metamat, node_tree, image_node):
             print(self.name + " map pre-bake")
-            spec_socket = metamat.principled_node.inputs[self.bsdf_sockets["Specular"]]
-            diff_socket = metamat.principled_node.inputs[self.bsdf_sockets["Color"]]
+            spec_socket = metamat.sockets[self.bsdf_sockets["Specular"]]
+            diff_socket = metamat.sockets[self.bsdf_sockets["Color"]]
 
             # If diff socket is linked, change the name and label
             if diff_socket.is_linked:
@@ -986,9 +1235,11 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
             if not spec_socket.is_linked:
                 # Create RGB node and attach
                 spec_value = math.sqrt(spec_socket.default_value) * 0.8
-                node = node_tree.nodes.new("ShaderNodeRGB")
+                node = node_tree.nodes.get("HPL3_RGB")
+                if node is None:
+                    node = node_tree.nodes.new("ShaderNodeRGB")
+                    node.name = "HPL3_RGB"
                 node.outputs[0].default_value = (spec_value, spec_value, spec_value, 1.0)
-                node.name = "HPL3_RGB"
                 node_tree.links.new(node.outputs[0], diff_socket)
             else:
                 spec_out_socket = None
@@ -1000,12 +1251,9 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
 
         def post_bake(self, metamat, node_tree, image_node):
             print(self.name + " map post-bake")
-            diff_socket = metamat.principled_node.inputs[self.bsdf_sockets["Color"]]
+            diff_socket = metamat.sockets[self.bsdf_sockets["Color"]]
             # BEWARE: Naming a node "HPL3_ORIGINALDIFF" will connect it even if was originally disconnected
-            original_diff = None
-            for node in node_tree.nodes:
-                if node.name == "HPL3_ORIGINALDIFF":
-                    original_diff = node
+            original_diff = node_tree.nodes.get("HPL3_ORIGINALDIFF")
             if original_diff is not None: # Re-link original diffuse node setup
                 original_socket = None
                 for socket in original_diff.outputs:
@@ -1013,16 +1261,23 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
                         original_socket = socket
                 node_tree.links.new(original_socket, diff_socket)
             else:
-                node = node_tree.nodes.new("ShaderNodeRGB")
+                node = node_tree.nodes.get("HPL3_DIFF_RGB")
+                if node is None:
+                    node = node_tree.nodes.new("ShaderNodeRGB")
+                    node.name = "HPL3_DIFF_RGB"
                 diff_color = diff_socket.default_value
                 node.outputs[0].default_value = (diff_color[0], diff_color[1], diff_color[2], 1.0)
-                node.name = "HPL3_DIFF_RGB"
                 node_tree.links.new(node.outputs[0], diff_socket)
+            # The spec RGB node from pre-bake is no longer connected
+            spec_rgb = node_tree.nodes.get("HPL3_RGB")
+            if spec_rgb is not None:
+                node_tree.nodes.remove(spec_rgb)
 
     class SpecularMap(MetaImage):
+        __slots__           = ()
         name                = "SPECULAR"
         suffix              = "_spec"
-        exportable          = True
+        exportable_default  = True
         special_bake_func   = True
         bake_using_diffuse  = False
         def pre_bake(self, metamat, node_tree, image_node):
@@ -1030,15 +1285,10 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
         def bake(self, mapgroup, metamat, node_tree, image_node):
             print(self.name + " map pre-bake")
             # Find rough and spec images in node tree
-            rough = None
-            spec = None
-            for node in node_tree.nodes:
-                #if (node.label == 'HPL3_ROUGHNESS'):
-                if (node.name == 'HPL3EXPORT_ROUGHNESS'):
-                    rough = node.image
-                #elif (node.label == 'HPL3_SPEC'):
-                elif (node.name == 'HPL3EXPORT_PRESPEC'):
-                    spec = node.image
+            rough_node = metamat.image_nodes.get('ROUGHNESS')
+            spec_node = metamat.image_nodes.get('PRESPEC')
+            rough = rough_node.image if rough_node is not None else None
+            spec = spec_node.image if spec_node is not None else None
             #if image_node.image.source == 'FILE':
             #    return # Skip whole function to avoid re-rendering
             # save then set renderer settings
@@ -1093,7 +1343,9 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
             # If bake image is a solid color, replace with RGB node
             if mapgroup.metaimages["PRESPEC"].is_microimage:
                 comp.append(comp_tree.nodes.new("CompositorNodeRGB"))
-                comp[4].outputs[0].default_value = (math.pow(spec.pixels[0],2.2), math.pow(spec.pixels[1],2.2), math.pow(spec.pixels[2],2.2), 1.0)
+                # One read of the pixel buffer instead of one per channel
+                r, g, b = spec.pixels[:3]
+                comp[4].outputs[0].default_value = (math.pow(r,2.2), math.pow(g,2.2), math.pow(b,2.2), 1.0)
             else:
                 comp.append(comp_tree.nodes.new("CompositorNodeImage"))
                 comp[4].image = spec
@@ -1126,7 +1378,8 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
             # If bake image is a solid color, replace with RGB node
             if mapgroup.metaimages["ROUGHNESS"].is_microimage:
                 comp.append(comp_tree.nodes.new("CompositorNodeRGB"))
-                comp[9].outputs[0].default_value = (math.pow(rough.pixels[0],2.2), math.pow(rough.pixels[1],2.2), math.pow(rough.pixels[2],2.2), 1.0)
+                r, g, b = rough.pixels[:3]
+                comp[9].outputs[0].default_value = (math.pow(r,2.2), math.pow(g,2.2), math.pow(b,2.2), 1.0)
             else:
                 comp.append(comp_tree.nodes.new("CompositorNodeImage"))
                 comp[9].image = rough
@@ -1134,12 +1387,8 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
             max_res_x = max(spec.size[0], rough.size[0])
             max_res_y = max(spec.size[1], rough.size[1])
             if max_res_x != 0 and max_res_y != 0:
-                base_2 = round(math.log(max_res_x,2))
-                base_2 = max(min(base_2, 14), 0)
-                max_res_x = int(math.pow(2, base_2))
-                base_2 = round(math.log(max_res_y,2))
-                base_2 = max(min(base_2, 14), 0)
-                max_res_y = int(math.pow(2, base_2))
+                max_res_x = snap_pow2(max_res_x)
+                max_res_y = snap_pow2(max_res_y)
             else:
                 max_res_x = hpl3export.map_res_x
                 max_res_y = hpl3export.map_res_y
@@ -1203,15 +1452,16 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
 
 
     class NormalMap(MetaImage):
+        __slots__           = ()
         name                = "NORMAL"
         suffix              = "_nrm"
-        exportable          = True
+        exportable_default  = True
         special_bake_func   = False
         bake_using_diffuse  = False
         def pre_bake(self, metamat, node_tree, image_node):
             print(self.name + " map pre-bake")
 
-            normal_socket = metamat.principled_node.inputs[self.bsdf_sockets["Normal"]]
+            normal_socket = metamat.sockets[self.bsdf_sockets["Normal"]]
             if normal_socket.is_linked:
                 # If user forgets to add a Normal Map node, place a new one in between
                 if (type(normal_socket.links[0].from_node) == bpy.types.ShaderNodeTexImage):
@@ -1231,7 +1481,8 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
                         if (type(normal_map_node.inputs[1].links[0].from_node) == bpy.types.ShaderNodeTexImage):
                             image_node = normal_map_node.inputs[1].links[0].from_node
                             if(image_node.image is not None):
-                                image_node.image.colorspace_settings.name = 'Non-Color'
+                                if image_node.image.colorspace_settings.name != 'Non-Color':
+                                    image_node.image.colorspace_settings.name = 'Non-Color'
                 # All other configurations will just be left alone to avoid unexpected bugs
 
         def post_bake(self, metamat, node_tree, image_node):
@@ -1240,16 +1491,17 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
 
 
     class DiffuseMap(MetaImage):
+        __slots__           = ()
         name                = "DIFFUSE"
         suffix              = ""
-        exportable          = True
+        exportable_default  = True
         special_bake_func   = False
         bake_using_diffuse  = True
         def pre_bake(self, metamat, node_tree, image_node):
             print(self.name + " map pre-bake")
         def post_bake(self, metamat, node_tree, image_node):
             print(self.name + " map post-bake")
-            node_tree.links.new(image_node.outputs["Color"], metamat.principled_node.inputs[self.bsdf_sockets["Color"]])
+            node_tree.links.new(image_node.outputs["Color"], metamat.sockets[self.bsdf_sockets["Color"]])
 
 
     # ------------------------------------------------------------------------
@@ -1260,9 +1512,9 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
         self.save_restore_bake_settings("save", bake_settings)
         for mapname, map in self.maps.items():
             # Deselect all objects
-            for ob in bpy.context.selected_objects:
-                ob.select_set(False)
+            deselect_all()
             using_map = False
+            active = None
             for mapgroup in self.mapgroups:
                 if mapname in mapgroup.metaimages:
                     # Do pre-bake operations
@@ -1272,8 +1524,12 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
                     # one instance of each mesh
                     for metamesh in mapgroup.metameshes:
                         metamesh.object.select_set(True)
+                        active = metamesh.object
             if not using_map:
                 continue
+            # Bake needs an active object among the selection
+            if active is not None:
+                bpy.context.view_layer.objects.active = active
             # Set up bake
             if map.special_bake_func:
                 for mapgroup in self.mapgroups:
@@ -1290,9 +1546,11 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
                 if mapname in mapgroup.metaimages:
                     # Do post-bake operations
                     mapgroup.prepare_post_bake(mapname)
-        for mapgroup in self.mapgroups:
-            # export
-            self.export_textures(hpl3export, mapgroup)
+        # Save every mapgroup's images, then convert them all in one pool
+        exported = [(mapgroup,) + self.export_textures(hpl3export, mapgroup) for mapgroup in self.mapgroups]
+        self.convert_textures([job for mapgroup, conversions, copies in exported for job in conversions])
+        for mapgroup, conversions, copies in exported:
+            self.finish_textures(mapgroup, conversions, copies)
             for mat_path in mapgroup.mat_paths:
                 self.generate_mat(hpl3export, mapgroup, mat_path)
         if hpl3export.bake_multi_mat_into_single == 'OP2':
@@ -1319,9 +1577,6 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
     def save_restore_bake_settings(self, mode, settings):
         scene = bpy.context.scene
         bake = scene.render.bake
-        attributes = "DIFFUSE:use_pass_direct DIFFUSE:use_pass_indirect DIFFUSE:use_pass_color " \
-        "NORMAL:normal_space NORMAL:normal_r NORMAL:normal_g NORMAL:normal_b " \
-        "ANY:margin ANY:use_clear ANY:use_selected_to_active".split(' ')
 
         if mode == "save":
             settings["bake_type"] = scene.cycles.bake_type
@@ -1334,19 +1589,17 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
             else:
                 settings["render_samples"] = scene.cycles.samples
 
-            for attribute in attributes:
-                bake_type = attribute.split(':')[0]
-                attr_string = attribute.split(':')[1]
+            for bake_type, attr_strings in BAKE_ATTRIBUTES:
                 if bake_type != "ANY":
                     scene.cycles.bake_type = bake_type
-                settings[attr_string] = getattr(bake, attr_string)
+                for attr_string in attr_strings:
+                    settings[attr_string] = getattr(bake, attr_string)
         else:
-            for attribute in attributes:
-                bake_type = attribute.split(':')[0]
-                attr_string = attribute.split(':')[1]
+            for bake_type, attr_strings in BAKE_ATTRIBUTES:
                 if bake_type != "ANY":
                     scene.cycles.bake_type = bake_type
-                setattr(bake, attr_string, settings[attr_string])
+                for attr_string in attr_strings:
+                    setattr(bake, attr_string, settings[attr_string])
             scene.cycles.bake_type = settings["bake_type"]
             scene.render.engine = settings["render_engine"]
             scene.cycles.samples = settings["render_samples"]
@@ -1360,9 +1613,10 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
         print("setting up bake")
         scene = bpy.context.scene
         scene.render.engine = 'CYCLES'
-        scene.cycles.device = 'GPU'
-        # # GPU baking errors in beta, use CPU for now
-        # scene.cycles.device = 'CPU'
+        if hpl3export.bake_device == 'GPU' and self.enable_gpu_devices():
+            scene.cycles.device = 'GPU'
+        else:
+            scene.cycles.device = 'CPU'
         scene.cycles.samples = 16
         scene.cycles.bake_type = bake_type
         scene.view_settings.exposure = 0
@@ -1390,6 +1644,44 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
         bake.use_clear = True
         bake.use_selected_to_active = False
 
+    # ------------------------------------------------------------------------
+    #    make sure Cycles has a GPU backend and device enabled, once per export
+    #   Returns: True if a GPU device can be used
+    # ------------------------------------------------------------------------
+    def enable_gpu_devices(self):
+        if self.gpu_available is not None:
+            return self.gpu_available
+        self.gpu_available = False
+        if "cycles" not in bpy.context.preferences.addons:
+            return False
+        cycles_prefs = bpy.context.preferences.addons["cycles"].preferences
+        def refresh():
+            if hasattr(cycles_prefs, "refresh_devices"):
+                cycles_prefs.refresh_devices()
+            else:
+                cycles_prefs.get_devices()
+        # Only pick a backend if the user hasn't, CUDA first since OptiX baking is unreliable on older versions
+        if cycles_prefs.compute_device_type == 'NONE':
+            for backend in ('CUDA', 'OPTIX', 'HIP', 'ONEAPI', 'METAL'):
+                try:
+                    cycles_prefs.compute_device_type = backend
+                except TypeError:
+                    continue
+                refresh()
+                if any(device.type == backend for device in cycles_prefs.devices):
+                    break
+            else:
+                cycles_prefs.compute_device_type = 'NONE'
+                return False
+        refresh()
+        gpus = [device for device in cycles_prefs.devices if device.type == cycles_prefs.compute_device_type]
+        # Respect the user's device choice, enable them all if none are
+        if gpus and not any(device.use for device in gpus):
+            for device in gpus:
+                device.use = True
+        self.gpu_available = len(gpus) > 0
+        return self.gpu_available
+
     def bake(self, hpl3export, bake_type):
         try:
             split_materials = hpl3export.bake_multi_mat_into_single != 'OP2'
@@ -1400,38 +1692,113 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
             raise self.ExportError
 
     def bake_micromaps(self, hpl3export, map_name, bake_type):
+        # Only needed if some image of this type is too small to bake directly
+        using_micro = False
+        for mapgroup in self.mapgroups:
+            if map_name in mapgroup.metaimages and mapgroup.metaimages[map_name].is_microimage:
+                using_micro = True
+        if not using_micro:
+            return
+        # Image nodes of this map type in each mapgroup, reused after the bake
+        mapgroup_nodes = []
         for mapgroup in self.mapgroups:
             # Set all images to their micro version
+            image_nodes = []
             for metamat in mapgroup.metamats:
-                node_tree = metamat.material.node_tree
-                if "HPL3EXPORT_" + map_name in metamat.material.node_tree.nodes:
-                    node = node_tree.nodes["HPL3EXPORT_" + map_name]
+                nodes = metamat.material.node_tree.nodes
+                node = metamat.image_nodes.get(map_name)
+                if node is not None:
                     node.image = mapgroup.metaimages[map_name].microimage
-                    node_tree.nodes.active = node
+                    nodes.active = node
+                    image_nodes.append(node)
                 else:
-                    node_tree.nodes.active = None
-            # Set meshes to versions with UVs reset
+                    nodes.active = None
+            mapgroup_nodes.append((mapgroup, image_nodes))
+            # Set meshes to versions with UVs reset, made the first time they're needed
             for metamesh in mapgroup.metameshes:
+                if metamesh.mesh_with_reset_uvs is None:
+                    metamesh.create_mesh_with_reset_uvs()
                 metamesh.object.data = metamesh.mesh_with_reset_uvs
         self.bake(hpl3export, bake_type)
-        for mapgroup in self.mapgroups:
+        for mapgroup, image_nodes in mapgroup_nodes:
             # Set mesh data back to original
             for metamesh in mapgroup.metameshes:
                 metamesh.object.data = metamesh.mesh_original
-            for metamat in mapgroup.metamats:
-                if "HPL3EXPORT_" + map_name in metamat.material.node_tree.nodes:
-                    node = metamat.material.node_tree.nodes["HPL3EXPORT_" + map_name]
-                    if mapgroup.metaimages[map_name].is_microimage:
-                        original = mapgroup.metaimages[map_name].image
-                        mapgroup.metaimages[map_name].image = mapgroup.metaimages[map_name].microimage
-                        mapgroup.metaimages[map_name].microimage = original
-                    node.image = mapgroup.metaimages[map_name].image
+            if not image_nodes:
+                continue
+            # Micro image becomes the mapgroup's image if the full size one is too small
+            mi = mapgroup.metaimages[map_name]
+            if mi.is_microimage:
+                mi.image, mi.microimage = mi.microimage, mi.image
+            # Nodes already hold the micro image when it's now the mapgroup's image
+            for node in image_nodes:
+                if node.image != mi.image:
+                    node.image = mi.image
+
+    # ------------------------------------------------------------------------
+    #    run queued TGA -> DDS conversions in parallel, removing each TGA
+    #    (and temp image) as soon as its conversion is done
+    #        jobs                - list (metaimage, tga file, dds file, params,
+    #                              whether to remove an existing DDS first)
+    # ------------------------------------------------------------------------
+    def convert_textures(self, jobs):
+        if not jobs:
+            return
+        # Don't pop up a console window per conversion on Windows
+        creationflags = getattr(subprocess, 'CREATE_NO_WINDOW', 0)
+        def convert(job):
+            mi, tga_file, dds_file, params, remove_old_dds = job
+            try:
+                if remove_old_dds and os.path.exists(dds_file):
+                    os.remove(dds_file)
+                subprocess.run([self.CONVERTERPATH] + params + [tga_file, dds_file], check=False, creationflags=creationflags)
+            except PermissionError:
+                print("Error: Permission denied removing " + dds_file)
+            leftovers = [tga_file]
+            if mi.temp_image != "" and mi.temp_image != tga_file:
+                leftovers.append(mi.temp_image)
+            for leftover in leftovers:
+                print("REMOVING ", leftover)
+                try:
+                    os.remove(leftover)
+                except OSError:
+                    print("Error: Could not remove " + leftover)
+        # Sanitized names can send two jobs to the same files; the last TGA saved
+        # is the one on disk, so only its job runs, as when converting one by one
+        by_dds = {}
+        for job in jobs:
+            by_dds[job[2]] = job
+        dropped = [job for job in jobs if by_dds[job[2]] is not job]
+        jobs = list(by_dds.values())
+        with ThreadPoolExecutor(max_workers=min(len(jobs), os.cpu_count() or 1)) as pool:
+            # list() re-raises any exception from a worker
+            list(pool.map(convert, jobs))
+        # Temp images of skipped jobs are removed once no worker can be using them
+        for mi, tga_file, dds_file, params, remove_old_dds in dropped:
+            if mi.temp_image != "" and os.path.exists(mi.temp_image):
+                print("REMOVING ", mi.temp_image)
+                try:
+                    os.remove(mi.temp_image)
+                except OSError:
+                    print("Error: Could not remove " + mi.temp_image)
+
     # ------------------------------------------------------------------------
-    #    export image and convert to DDS
-    #        image               - list (image datablock, export path, type)
+    #    export images to TGA, returning the DDS conversions and the copies of
+    #    converted files for multi export, to run once every TGA is saved
     # ------------------------------------------------------------------------
     def export_textures(self, hpl3export, mapgroup):
-        new_metaimages = {}
+        conversions = []
+        copies = []
+        scene = bpy.context.scene
+        image_settings = scene.render.image_settings
+        if image_settings.file_format != 'TARGA':
+            image_settings.file_format = 'TARGA'
+        if image_settings.color_mode != 'RGBA':
+            image_settings.color_mode = 'RGBA'
+        # In Blender 4.0 and later, apply standard view transform to saved images
+        if bpy.app.version >= (4, 0, 0):
+            scene_view_transform = scene.view_settings.view_transform
+            scene.view_settings.view_transform = "Standard"
         for key, mi in mapgroup.metaimages.items():
             if not mi.exportable:
                 continue
@@ -1444,12 +1811,6 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
                 dds_file = export_path + mi.suffix + ".dds"
                 if idx == 0:
                     initial_dds = dds_file
-                    bpy.context.scene.render.image_settings.file_format = 'TARGA'
-                    bpy.context.scene.render.image_settings.color_mode = 'RGBA'
-                    # In Blender 4.0 and later, apply standard view transform to saved images
-                    if bpy.app.version >= (4, 0, 0):
-                        scene_view_transform = bpy.context.scene.view_settings.view_transform
-                        bpy.context.scene.view_settings.view_transform = "Standard"
                     try:
                         mi.image.save_render(tga_file)
                     except RuntimeError:
@@ -1460,52 +1821,53 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
                     except PermissionError:
                         message = "Permission denied writing " + tga_file
                         print(message)
-                        return 1
+                        if bpy.app.version >= (4, 0, 0):
+                            scene.view_settings.view_transform = scene_view_transform
+                        return conversions, []
                         #self.report({'WARNING'}, "%s" % (message))
-                    if bpy.app.version >= (4, 0, 0):
-                        bpy.context.scene.view_settings.view_transform = scene_view_transform
                     # Export DDS
                     if mi.name == 'NORMAL':
-                        params=" -normal -bc5 "
+                        params = ["-normal", "-bc5"]
                     elif mi.name == "SPECULAR":
-                        params=" -alpha -bc3 "
+                        params = ["-alpha", "-bc3"]
                     else:
-                        params=" -bc1 "
-                    output2='"'+dds_file+'"'
-                    input2='"'+tga_file+'"'
-                    error = True
-                    try:
-                        if (mi.image.source == 'FILE') and (os.path.exists(dds_file)):
-                                os.remove(dds_file)
-                        error = os.system('"'+self.CONVERTERPATH+params+" "+input2+" "+output2+'"')
-                    except PermissionError:
-                        print("Error: Permission denied removing " + dds_file)
-                    print("REMOVING ", tga_file)
-                    os.remove(tga_file)
-                    if mi.temp_image != "" and mi.temp_image != tga_file:
-                        print("REMOVING ", mi.temp_image)
-                        os.remove(mi.temp_image)
-                    # hook diffuse images up to exported file
-                    if key == "DIFFUSE":
-                        mi.image.source = "FILE"
-                        mi.image.filepath = dds_file
+                        params = ["-bc1"]
+                    # Read on the main thread; bpy isn't safe to touch from the workers
+                    conversions.append((mi, tga_file, dds_file, params, mi.image.source == 'FILE'))
                 elif hpl3export.multi_mode == "MULTI":
-                    print("Copying file " + initial_dds)
-                    try:
-                        if not os.path.isdir(os.path.dirname(dds_file)):
-                            os.mkdir(os.path.dirname(dds_file))
-                        copyfile(initial_dds, dds_file)
-                    except IOError:
-                        print("Error: Permission denied copying " + initial_dds + " to " + dds_file)
-                    if key == "DIFFUSE":
-                        new_metaimages[metamesh.object.name] = self.set_up_diffuse_ref(mapgroup, dds_file, metamesh.object, mapgroup.metamats[0])
+                    copies.append((key, initial_dds, dds_file, metamesh))
+        if bpy.app.version >= (4, 0, 0):
+            scene.view_settings.view_transform = scene_view_transform
+        return conversions, copies
+
+    # ------------------------------------------------------------------------
+    #    after conversion, hook up diffuse images and copy DDS files for
+    #    multi export
+    # ------------------------------------------------------------------------
+    def finish_textures(self, mapgroup, conversions, copies):
+        new_metaimages = {}
+        # hook diffuse images up to exported file
+        for mi, tga_file, dds_file, params, remove_old_dds in conversions:
+            if mi.name == "DIFFUSE":
+                mi.image.source = "FILE"
+                mi.image.filepath = dds_file
+        for key, initial_dds, dds_file, metamesh in copies:
+            print("Copying file " + initial_dds)
+            try:
+                if not os.path.isdir(os.path.dirname(dds_file)):
+                    os.mkdir(os.path.dirname(dds_file))
+                copyfile(initial_dds, dds_file)
+            except IOError:
+                print("Error: Permission denied copying " + initial_dds + " to " + dds_file)
+            if key == "DIFFUSE":
+                new_metaimages[metamesh.object.name] = self.set_up_diffuse_ref(mapgroup, dds_file, metamesh.object, mapgroup.metamats[0])
         # Add newly created metaimages
         for key, mi in new_metaimages.items():
             mi.exportable = False
             mapgroup.metaimages[key] = mi
 
     def get_export_dir(self, hpl3export, meshname):
-        meshname_clean = re.sub('[^0-9a-zA-Z]+', '_', meshname)
+        meshname_clean = sanitize_name(meshname)
         if hpl3export.multi_mode == "MULTI":
             export_dir = self.export_path + meshname_clean + "/"
         else:
@@ -1513,19 +1875,22 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
         return export_dir
 
     def get_full_export_path(self, hpl3export, mapgroup, mesh):
-        meshname_clean = re.sub('[^0-9a-zA-Z]+', '_', mesh["hpl3export_mesh_name"])
-        export_dir = self.get_export_dir(hpl3export, mesh["hpl3export_mesh_name"])
-        matname_clean = re.sub('[^0-9a-zA-Z]+', '_', mapgroup.metamats[0].original.name)
-        export_name = meshname_clean if hpl3export.bake_multi_mat_into_single == 'OP2' else matname_clean
-        return export_dir + export_name
+        # Keyed on the name the path is built from; addresses of freed objects get reused
+        key = mesh["hpl3export_mesh_name"]
+        result = mapgroup.export_paths.get(key)
+        if result is None:
+            meshname_clean = sanitize_name(key)
+            export_dir = self.get_export_dir(hpl3export, key)
+            matname_clean = sanitize_name(mapgroup.metamats[0].original.name)
+            export_name = meshname_clean if hpl3export.bake_multi_mat_into_single == 'OP2' else matname_clean
+            result = export_dir + export_name
+            mapgroup.export_paths[key] = result
+        return result
 
     def set_up_diffuse_ref(self, mapgroup, dds_file, current_obj, metamat):
         # Get mesh material slots and find which slot the mat is in
-        dest_slot = None
-        for idx,slot in enumerate(current_obj.material_slots):
-            if slot.material is not None:
-                if slot.material.name == metamat.material.name:
-                    dest_slot = slot
+        slot_by_matname = {slot.material.name: slot for slot in current_obj.material_slots if slot.material is not None}
+        dest_slot = slot_by_matname.get(metamat.material.name)
         # Create a new material named [meshname][matname] and add to slot
         new_mat_name = "hpl3export_" + current_obj.name + "_" + metamat.material.name
         new_metamat = self.add_basic_material(current_obj, new_mat_name)
@@ -1533,13 +1898,12 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
         # Make an image node, assign a new image, set file to dds_file, connect
         new_mat = dest_slot.material
         new_img_node = new_mat.node_tree.nodes.new("ShaderNodeTexImage")
-        bpy.ops.image.new(name=new_mat_name, width=4, height=4)
         mi = self.DiffuseMap(self.bsdf_sockets, "Color")
-        mi.image = bpy.context.blend_data.images[new_mat_name]
+        mi.image = bpy.data.images.new(name=new_mat_name, width=4, height=4, alpha=True)
         mi.image.source = "FILE"
         mi.image.filepath = dds_file
         new_img_node.image = mi.image
-        new_mat.node_tree.links.new(new_img_node.outputs["Color"], new_metamat.principled_node.inputs[self.bsdf_sockets["Color"]])
+        new_mat.node_tree.links.new(new_img_node.outputs["Color"], new_metamat.sockets[self.bsdf_sockets["Color"]])
         # Add new material to metamats
         mapgroup.metamats.append(new_metamat)
         return mi
@@ -1561,18 +1925,16 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
             if dupe.type == "ARMATURE":
                 self.prepare_armature(dupe)
 
-        # Update once to use newly-transformed bone matrices
+        # Update once to use newly-transformed bone matrices, and evaluate
+        # modifiers from that state for every mesh
         bpy.context.view_layer.update()
+        depsgraph = bpy.context.evaluated_depsgraph_get()
 
         # Prepare meshes
         for dupe in self.dupes:
-            parent_armature = None
             if dupe.type == "MESH":
-                for mod in dupe.modifiers:
-                    if mod.type == 'ARMATURE':
-                        if mod.object is not None:
-                            parent_armature = mod.object
-                subobjects = self.prepare_mesh(hpl3export, dupe, parent_armature)
+                parent_armature = self.get_armature(dupe)
+                subobjects = self.prepare_mesh(hpl3export, dupe, parent_armature, depsgraph)
                 dupes_to_export.append(
                     {
                         "name": dupe["hpl3export_mesh_name"],
@@ -1613,17 +1975,11 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
     # ------------------------------------------------------------------------
 
     def prepare_parent(self, dupe):
-        parent_armature = None
-        if dupe.type == "MESH":
-            for mod in dupe.modifiers:
-                if mod.type == 'ARMATURE':
-                    if mod.object is not None:
-                        parent_armature = mod.object
+        parent_armature = self.get_armature(dupe)
         if parent_armature is not None:
             if dupe.parent is None:
                 # Deselect all
-                for ob in bpy.context.selected_objects:
-                    ob.select_set(False)
+                deselect_all()
                 dupe.select_set(True)
                 parent_armature.select_set(True)
                 bpy.context.view_layer.objects.active = parent_armature
@@ -1636,12 +1992,7 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
         is_multiexport = (self.main_tool.multi_mode == "MULTI")
 
         # Use transforms of active's armature if it has one
-        armature_of_activeobj = None
-        if self.active_object.type == "MESH":
-            for mod in self.active_object.modifiers:
-                if mod.type == 'ARMATURE':
-                    if mod.object is not None:
-                        armature_of_activeobj = mod.object
+        armature_of_activeobj = self.get_armature(self.active_object)
         if armature_of_activeobj is not None:
             active_mat = armature_of_activeobj.matrix_world
         else:
@@ -1657,14 +2008,13 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
     # ------------------------------------------------------------------------
     #    Prepare meshes for export
     # ------------------------------------------------------------------------
-    def prepare_mesh(self, hpl3export, dupe, parent_armature):
+    def prepare_mesh(self, hpl3export, dupe, parent_armature, depsgraph):
         is_single_mat = (self.main_tool.bake_multi_mat_into_single == 'OP2')
         is_multiexport = (self.main_tool.multi_mode == "MULTI")
-        is_rigged = (parent_armature != None)
+        is_rigged = parent_armature is not None
 
         if not is_rigged:
             # Apply modifiers
-            depsgraph = bpy.context.evaluated_depsgraph_get()
             mod_mesh = bpy.data.meshes.new_from_object(dupe.evaluated_get(depsgraph), preserve_all_data_layers=True, depsgraph=depsgraph)
 
             if hpl3export.bake_multi_mat_into_single != 'OP3':
@@ -1687,8 +2037,7 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
             else:
                 dupe.matrix_world = self.active_object.matrix_world.inverted_safe() @ dupe.matrix_world
 
-        for ob in bpy.context.selected_objects:
-            ob.select_set(False)
+        deselect_all()
         dupe.select_set(True)
 
         bpy.ops.object.parent_clear(type='CLEAR_KEEP_TRANSFORM')
@@ -1701,16 +2050,14 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
         if is_single_mat:
             # Get first material
             mat_slots = dupe.data.materials
-            first_mat = None
-            for index in range(len(mat_slots)):
-                if mat_slots[index] is not None and first_mat is None:
-                    first_mat = mat_slots[index]
+            first_mat = next((mat for mat in mat_slots if mat is not None), None)
             # Clear slots
-            while mat_slots:
-                if bpy.app.version >= (2, 81, 0):
-                    mat_slots.pop(index=0)
-                else:
-                    mat_slots.pop(index=0, update_data=True)
+            if bpy.app.version >= (2, 81, 0):
+                mat_slots.clear()
+            else:
+                # Pop from the end so no remaining slots have to shift down
+                for index in range(len(mat_slots) - 1, -1, -1):
+                    mat_slots.pop(index=index, update_data=True)
             # Add and assign only one material
             mat_slots.append(first_mat)
         else:
@@ -1725,16 +2072,9 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
 
     def convert_matrix(self, matrix, parent_armature = None):
         # Wacky transform
-        local_rot_x = mathutils.Matrix.Rotation(math.radians(-90.0), 4, 'X')
-        local_rot_z = mathutils.Matrix.Rotation(math.radians(180.0), 4, 'Z')
-        world_mat = matrix.copy()
-        world_rot_y = mathutils.Matrix.Identity(4)
         if parent_armature is not None:
-            world_mat = parent_armature.matrix_world.copy()
-            world_rot_y = mathutils.Matrix.Rotation(math.radians(-90.0), 4, 'Y')
-        column_reorder = mathutils.Matrix(((0,1,0,0), (0,0,1,0), (1,0,0,0), (0,0,0,1)))
-        result_mat = world_rot_y @ column_reorder @ world_mat @ local_rot_x @ local_rot_z
-        return result_mat
+            return PRE_ARM @ parent_armature.matrix_world @ LOCAL_ROTS
+        return COLUMN_REORDER @ matrix @ LOCAL_ROTS
 
 
     # ------------------------------------------------------------------------
@@ -1743,8 +2083,7 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
     # ------------------------------------------------------------------------
     def export_mesh(self, dupe_dict):
         # Deselect all
-        for ob in bpy.context.selected_objects:
-            ob.select_set(False)
+        deselect_all()
         for subobject in dupe_dict["subobjects"]:
             if subobject[0].type == "MESH":
                 subobject[0].select_set(True)
@@ -1754,27 +2093,32 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
                         if mod.object is not None:
                             mod.object.select_set(True)
         # Sanitize name and build filepath
-        san_name = re.sub('[^0-9a-zA-Z]+', '_', dupe_dict["name"])
+        san_name = sanitize_name(dupe_dict["name"])
         filepath = self.mesh_export_path + "/" + san_name + "/" + san_name + ".dae"
 
         # Get polycounts
         polycounts = []
+        bm = bmesh.new()
         for subobject in dupe_dict["subobjects"]:
-            # Triangulate and get face count
-            bm = bmesh.new()
-            bm.from_mesh(subobject[0].data)
-            bmesh.ops.triangulate(bm, faces=bm.faces[:], quad_method='BEAUTY', ngon_method='BEAUTY')
-            bm.to_mesh(subobject[0].data)
-            bm.free()
+            # Triangulate and get face count, skipping meshes that are all triangles
+            mesh = subobject[0].data
+            loop_totals = np.empty(len(mesh.polygons), dtype=np.int32)
+            mesh.polygons.foreach_get("loop_total", loop_totals)
+            if not (loop_totals == 3).all():
+                bm.clear()
+                bm.from_mesh(mesh)
+                bmesh.ops.triangulate(bm, faces=bm.faces[:], quad_method='BEAUTY', ngon_method='BEAUTY')
+                bm.to_mesh(mesh)
             polycounts.append({
                 "object": subobject[0],
-                "count": str(len(subobject[0].data.polygons)),
-                "WorldPos": "{:.5f}".format(subobject[0].location[0]) + " " + "{:.5f}".format(subobject[0].location[1]) + " " + "{:.5f}".format(subobject[0].location[2]),
-                "Rotation": "{:.5f}".format(subobject[0].rotation_euler[0]) + " " + "{:.5f}".format(subobject[0].rotation_euler[1]) + " " + "{:.5f}".format(subobject[0].rotation_euler[2]),
-                "Scale": "{:.5f}".format(subobject[0].scale[0]) + " " + "{:.5f}".format(subobject[0].scale[1]) + " " + "{:.5f}".format(subobject[0].scale[2]),
+                "count": str(len(mesh.polygons)),
+                "WorldPos": FMT3(*subobject[0].location),
+                "Rotation": FMT3(*subobject[0].rotation_euler),
+                "Scale": FMT3(*subobject[0].scale),
                 "original_mat" : subobject[1],
                 "parent_armature" : subobject[2]
             })
+        bm.free()
         # Export to DAE
         bpy.ops.wm.collada_export(
             filepath=filepath,
@@ -1829,7 +2173,7 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
                 entry.attrib["Wrap"] =  "Repeat"
         specific_variables = ET.SubElement(mat_root, "SpecificVariables")
 
-        ET.ElementTree(mat_root).write(mat_output_path)
+        write_xml(mat_root, mat_output_path)
         mat_root.clear()
 
     # ------------------------------------------------------------------------
@@ -1843,9 +2187,9 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
         print(".ent exists, updating")
 
         ent_path = self.export_path + dupe_dict["name"] + "/" + dupe_dict["name"] + ".ent"
-        short_path = re.sub(r'.*\/SOMA\/', '', self.export_path + dupe_dict["name"] + "/" + dupe_dict["name"] + ".dae")
+        short_path = RE_SOMA_PREFIX.sub('', self.export_path + dupe_dict["name"] + "/" + dupe_dict["name"] + ".dae")
         try:
-            ent_root = ET.parse(ent_path).getroot()
+            ent_root = read_xml(ent_path)
         except IOError:
             print("Could not update ent. Overwriting")
             return 1
@@ -1876,7 +2220,7 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
                 submesh.attrib["TriCount"] = str(entry["count"])
                 submesh.attrib["Material"] = ""
                 index += 1
-            ET.ElementTree(ent_root).write(ent_path)
+            write_xml(ent_root, ent_path)
         else:
             return 1
 
@@ -1891,13 +2235,7 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
     def generate_ent(self, dupe_dict, polycounts):
         print("no .ent exists. Creating")
         # Check object for an armature modifier
-        is_rigged = False
-        for entry in polycounts:
-            for mod in entry["object"].modifiers:
-                if mod.type == 'ARMATURE':
-                    if mod.object is not None:
-                        is_rigged = True
-                        break
+        is_rigged = any(self.get_armature(entry["object"]) is not None for entry in polycounts)
 
         print("Exporting .ent")
         ent_path = self.export_path + dupe_dict["name"] + "/" + dupe_dict["name"] + ".ent"
@@ -1906,34 +2244,29 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
         model_data = ET.SubElement(ent_root, "ModelData")
         entities = ET.SubElement(model_data, "Entities")
         mesh = ET.SubElement(model_data, "Mesh")
-        short_path = re.sub(r'.*\/SOMA\/', '', self.export_path + dupe_dict["name"] + "/" + dupe_dict["name"] + ".dae")
+        short_path = RE_SOMA_PREFIX.sub('', self.export_path + dupe_dict["name"] + "/" + dupe_dict["name"] + ".dae")
         mesh.attrib["Filename"] = short_path
         shapes = ET.SubElement(model_data, "Shapes")
         bodies = ET.SubElement(model_data, "Bodies")
         index = 0
         for entry in polycounts:
             object = entry["object"]
-            submesh = ET.SubElement(mesh, "SubMesh")
-            submesh.attrib["ID"] = str(index)
-            submesh.attrib["Name"] = object.name
-            submesh.attrib["CreStamp"] = "0"
-            submesh.attrib["ModStamp"] = "0"
-            submesh.attrib["WorldPos"] = entry["WorldPos"]
-            submesh.attrib["Rotation"] = entry["Rotation"]
-            submesh.attrib["Scale"] = entry["Scale"]
-            submesh.attrib["TriCount"] = str(entry["count"])
-            submesh.attrib["Material"] = ""
+            ET.SubElement(mesh, "SubMesh", attrib={
+                "ID": str(index),
+                "Name": object.name,
+                "CreStamp": "0",
+                "ModStamp": "0",
+                "WorldPos": entry["WorldPos"],
+                "Rotation": entry["Rotation"],
+                "Scale": entry["Scale"],
+                "TriCount": str(entry["count"]),
+                "Material": ""
+            })
             if self.main_tool.add_bodies:
                 # Get object name, bound box, and transforms
 
                 # Create Shape
                 shape_index = len(polycounts) + (index * 2)
-                shape = ET.SubElement(shapes, "Shape")
-                shape.attrib["ID"] = str(shape_index)
-                shape.attrib["Name"] = "shape_" + object.name
-                shape.attrib["CreStamp"] = "0"
-                shape.attrib["ModStamp"] = "0"
-                shape.attrib["Rotation"] = entry["Rotation"]
                 # Get bounding box dimensions
                 box_scale = (
                     (object.bound_box[4][0] - object.bound_box[0][0]),
@@ -1955,35 +2288,41 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
                 final_mat = self.convert_matrix(box_mat, entry["parent_armature"])
                 loc, rot, scale = final_mat.decompose()
 
-                box_scale_str = "{:.5f}".format(scale[0]) + " " + "{:.5f}".format(scale[1]) + " " + "{:.5f}".format(scale[2])
-                box_offset_str = "{:.5f}".format(loc[0]) + " " + "{:.5f}".format(loc[1]) + " " + "{:.5f}".format(loc[2])
-                #shape.attrib["WorldPos"] = entry["WorldPos"]
-                shape.attrib["WorldPos"] = box_offset_str
-                shape.attrib["Scale"] = box_scale_str
-                shape.attrib["RelativeTranslation"] = box_offset_str
-                shape.attrib["RelativeRotation"] = entry["Rotation"]
-                shape.attrib["RelativeScale"] = "1 1 1"
-                shape.attrib["ShapeType"] = "Box"
+                box_scale_str = FMT3(*scale)
+                box_offset_str = FMT3(*loc)
+                ET.SubElement(shapes, "Shape", attrib={
+                    "ID": str(shape_index),
+                    "Name": "shape_" + object.name,
+                    "CreStamp": "0",
+                    "ModStamp": "0",
+                    "Rotation": entry["Rotation"],
+                    #"WorldPos": entry["WorldPos"],
+                    "WorldPos": box_offset_str,
+                    "Scale": box_scale_str,
+                    "RelativeTranslation": box_offset_str,
+                    "RelativeRotation": entry["Rotation"],
+                    "RelativeScale": "1 1 1",
+                    "ShapeType": "Box"
+                })
 
                 # Create body
                 body_index = len(polycounts) + (index * 2) + 1
-                body = ET.SubElement(bodies, "Body")
-                body.attrib["ID"] = str(body_index)
-                body.attrib["Name"] = "body_" + object.name
-                body.attrib["CreStamp"] = "0"
-                body.attrib["ModStamp"] = "0"
-                body.attrib["WorldPos"] = entry["WorldPos"]
-                body.attrib["Rotation"] = "0 0 0"
-                body.attrib["Scale"] = "1 1 1"
-                body.attrib["Material"] = "Wood"
-                body.attrib["Mass"] = "1"
+                body = ET.SubElement(bodies, "Body", attrib={
+                    "ID": str(body_index),
+                    "Name": "body_" + object.name,
+                    "CreStamp": "0",
+                    "ModStamp": "0",
+                    "WorldPos": entry["WorldPos"],
+                    "Rotation": "0 0 0",
+                    "Scale": "1 1 1",
+                    "Material": "Wood",
+                    "Mass": "1"
+                })
                 # Other attributes here
 
                 children = ET.SubElement(body, "Children")
-                child = ET.SubElement(children, "Child")
-                child.attrib["ID"] = str(index)
-                shape_assoc = ET.SubElement(body, "Shape")
-                shape_assoc.attrib["ID"] = str(shape_index)
+                ET.SubElement(children, "Child", attrib={"ID": str(index)})
+                ET.SubElement(body, "Shape", attrib={"ID": str(shape_index)})
 
             index += 1
         bones = ET.SubElement(model_data, "Bones")
@@ -2002,7 +2341,7 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
         var.attrib["Name"] = "ShowMesh"
         var.attrib["Value"] = "true"
 
-        ET.ElementTree(ent_root).write(ent_path)
+        write_xml(ent_root, ent_path)
 
     # ------------------------------------------------------------------------
     #    remove unused files
@@ -2011,6 +2350,8 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
     def delete_assets(self, hpl3export, shortname_list):
         leftover_files = []
         for entry in shortname_list:
+            if entry == "":
+                continue
             error = self.delete_by_shortname(entry)
             if error:
                 leftover_files.append(entry)
@@ -2018,61 +2359,45 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
         return leftover_files
 
     def delete_by_shortname(self, shortname):
-        SOMA_path = re.sub(r'\\SOMA\\.*', '', self.mesh_export_path)
-        # If re.sub worked, add SOMA back to path
-        if SOMA_path != self.mesh_export_path:
-            SOMA_path = SOMA_path + "\\SOMA\\"
-        else:
-            # Don't prepend SOMA path
-            SOMA_path = ""
-        if shortname != "":
-            try:
-                os.remove(SOMA_path + shortname)
-                print("Removed file " + shortname)
-            except FileNotFoundError:
-                # If file is missing, remove from .xml in parent function
-                print("Warning: File '" + shortname + "' not found")
-            except:
-                print("Warning: Could not delete '" + shortname + "'.")
-                return 1
+        try:
+            os.remove(self.soma_prefix + shortname)
+            print("Removed file " + shortname)
+        except FileNotFoundError:
+            # If file is missing, remove from .xml in parent function
+            print("Warning: File '" + shortname + "' not found")
+        except:
+            print("Warning: Could not delete '" + shortname + "'.")
+            return 1
         return 0
 
     def delete_unused_textures(self, hpl3export):
-        exported_maps = {}
-        # Form a dictionary with format { mesh shortpath : [texture shortpaths] }
+        exported_maps = defaultdict(dict)
+        is_multiexport = hpl3export.multi_mode == "MULTI"
+        if not is_multiexport:
+            active_mesh_name = self.get_custom_property(self.active_object, "hpl3export_mesh_name")
+        # Form a dictionary with format { mesh shortpath : { lowercased texture shortpath : texture shortpath } }
         for mapgroup in self.mapgroups:
             for metamesh in mapgroup.metameshes:
-                mesh_name = metamesh.object["hpl3export_mesh_name"] if hpl3export.multi_mode == "MULTI" else self.get_custom_property(self.active_object, "hpl3export_mesh_name")
+                mesh_name = metamesh.object["hpl3export_mesh_name"] if is_multiexport else active_mesh_name
                 mesh_dir = self.get_export_dir(hpl3export, mesh_name)
-                mesh_path = mesh_dir + re.sub('[^0-9a-zA-Z]+', '_', mesh_name) + ".dae"
-                mesh_path = re.sub(r'.*\/SOMA\/', '', mesh_path)
+                mesh_path = mesh_dir + sanitize_name(mesh_name) + ".dae"
+                mesh_path = RE_SOMA_PREFIX.sub('', mesh_path)
+                # Texture paths only differ by suffix
+                texture_prefix = RE_SOMA_PREFIX.sub('', self.get_full_export_path(hpl3export, mapgroup, metamesh.object))
                 for idx, mi in mapgroup.metaimages.items():
                     if mi.exportable:
-                        export_path = self.get_full_export_path(hpl3export, mapgroup, metamesh.object) + mi.suffix + ".dds"
-                        export_path = re.sub(r'.*\/SOMA\/', '', export_path)
-                        if mesh_path not in exported_maps.keys():
-                            exported_maps[mesh_path] = [export_path]
-                        elif export_path not in exported_maps[mesh_path]:
-                            exported_maps[mesh_path].append(export_path)
-        files_to_delete = []
-        for key, mesh in exported_maps.items():
-            matching_entry = None
-            for entry in self.asset_xml.iter("Asset"):
-                dae_path = entry.attrib["DAEpath"]
-                if key.lower() == dae_path.lower():
-                    matching_entry = entry
+                        export_path = texture_prefix + mi.suffix + ".dds"
+                        exported_maps[mesh_path].setdefault(export_path.lower(), export_path)
+        for key, textures in exported_maps.items():
+            matching_entry = self.asset_by_dae.get(key.lower())
             if matching_entry is not None:
                 if "DDSpath" in matching_entry.attrib:
                     for texture in matching_entry.attrib["DDSpath"].split(";"):
-                        exists = False
-                        for existing in exported_maps[key]:
-                            if texture.lower() == existing.lower():
-                                exists = True
-                        if not exists:
+                        if texture != "" and texture.lower() not in textures:
                             error = self.delete_by_shortname(texture)
                             if error:
-                                exported_maps[key].append(texture)
-                matching_entry.attrib["DDSpath"] = ';'.join(exported_maps[key])
+                                textures[texture.lower()] = texture
+                matching_entry.attrib["DDSpath"] = ';'.join(textures.values())
     # ------------------------------------------------------------------------
     #    delete HPL3 map entries that do not match an object in blender
     # ------------------------------------------------------------------------
@@ -2081,141 +2406,158 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
         if hpl3export.entity_option == 'OP2':
             is_ent = True
         # Get 'Blender@HPL3EXPORT' section of XML
-        section = None
-        for child in self.root:
-            if child.get("Name") == "Blender@HPL3EXPORT":
-                section = child
+        section = self.root.find(EXPORT_SECTION_PATH)
         if section is None:
             return 0 #Empty
         else:
             objects = section.find("Objects")
+        # Snapshot of the entries; removals from the tree happen at the end
+        entries = list(objects)
+        files = section.find("FileIndex_Entities" if is_ent else "FileIndex_StaticObjects")
+        # Names of blender objects as written to the map
+        scene_names = {sanitize_name(obj.name) for obj in bpy.context.scene.objects}
+        # Numbers are only parsed once the first entry is removed and kept as
+        # ints while files are removed; changed ones are written back on return
+        num_files = None
+        file_ids = {}
+        entry_idx = {}
+        idx_counts = Counter()
+        def parse_int(value):
+            try:
+                return int(value)
+            except (TypeError, ValueError):
+                return None
+        def parse_indices():
+            nonlocal num_files, idx_counts
+            num_files = parse_int(files.get("NumOfFiles")) if files is not None else None
+            if files is not None:
+                for file in files.iter("File"):
+                    file_id = parse_int(file.get("Id"))
+                    if file_id is not None:
+                        file_ids[file] = file_id
+            # Entries without a usable index can't share or renumber a file
+            for entry in entries:
+                idx = parse_int(entry.get("FileIndex"))
+                if idx is not None:
+                    entry_idx[entry] = idx
+            # Number of map entries not yet removed that use each file index
+            idx_counts = Counter(entry_idx.values())
+            return num_files, dict(file_ids), dict(entry_idx)
+        original = None
+        def write_back():
+            if original is None:
+                return
+            orig_num, orig_ids, orig_idx = original
+            if files is not None and num_files is not None and num_files != orig_num:
+                files.attrib["NumOfFiles"] = str(num_files)
+            for file, file_id in file_ids.items():
+                if file_id != orig_ids[file]:
+                    file.attrib["Id"] = str(file_id)
+            for entry, idx in entry_idx.items():
+                if idx != orig_idx[entry]:
+                    entry.attrib["FileIndex"] = str(idx)
         # For each object in the HPL3 map
         entries_to_remove = []
-        for entry in objects:
-            exists = 0
+        for entry in entries:
             # Find corresponding blender object
-            for obj in bpy.context.scene.objects:
-                if re.sub('[^0-9a-zA-Z]+', '_', obj.name) == entry.get("Name"):
-                    exists = 1
-                    break
-            if not exists:
+            if entry.get("Name") not in scene_names:
+                if original is None:
+                    original = parse_indices()
                 removed_name = entry.get("Name")
-                removed_idx = entry.get("FileIndex")
                 entries_to_remove.append(entry)
-                in_use = 0
+                removed_idx = entry_idx.get(entry)
+                if removed_idx is None or files is None:
+                    continue
+                idx_counts[removed_idx] -= 1
                 # If removed object's file is still in use, ignore
-                for entry2 in objects:
-                    if entry2.get("FileIndex") == removed_idx and entry2.get("Name") != entry.get("Name") and entry2 not in entries_to_remove:
-                        in_use = 1
-                        break
+                in_use = idx_counts[removed_idx] > 0
                 if not in_use:
-                    dae_path = None
+                    remove = next((file for file, file_id in file_ids.items() if file_id == removed_idx), None)
+                    if remove is None:
+                        continue
+                    print("\tdeleting index ", removed_idx, " or ", remove.get("Path"))
+                    dae_path = remove.get("Path")
                     # Remove file index from map file and reorder indices
-                    if is_ent:
-                        files = section.find("FileIndex_Entities")
-                    else:
-                        files = section.find("FileIndex_StaticObjects")
-                    files.attrib["NumOfFiles"] = str(int(files.attrib["NumOfFiles"]) - 1)
-                    remove = None
-                    for file in files.iter("File"):
-                        if file.get("Id") == removed_idx:
-                            print("\tdeleting index ", file.get("Id"), " or ", file.get("Path"))
-                            dae_path = file.get("Path")
-                            remove = file
+                    if num_files is not None:
+                        num_files -= 1
+                    for file, file_id in file_ids.items():
                         # If Id is greater than removed index, decrement the value
-                        elif (int(file.get("Id")) > int(removed_idx)):
-                            file.attrib["Id"] = str(int(file.attrib["Id"]) - 1)
+                        if file_id > removed_idx:
+                            file_ids[file] = file_id - 1
                     files.remove(remove)
+                    del file_ids[remove]
                     # Renumber indices in object list
-                    for entry2 in objects:
-                        if int(entry2.get("FileIndex")) > int(removed_idx):
-                            entry2.attrib["FileIndex"] = str(int(entry2.attrib["FileIndex"]) - 1)
+                    for entry2, idx in entry_idx.items():
+                        if idx > removed_idx:
+                            entry_idx[entry2] = idx - 1
+                    idx_counts = Counter({(idx - 1 if idx > removed_idx else idx): count for idx, count in idx_counts.items() if idx != removed_idx})
                     # Find asset in list and remove .dae and .dds
-                    asset = None
-
                     if is_ent:
-                        dae_path = re.sub(r'ent$', 'dae', dae_path)
-                    for listing in self.asset_xml.iter("Asset"):
-                        if dae_path == listing.get("DAEpath"):
-                            asset = listing
-                            break
+                        dae_path = RE_ENT_EXT.sub('dae', dae_path)
+                    asset = self.asset_by_dae.get(dae_path.lower())
                     if asset is not None:
                         if asset.get("Uses") == "1" or asset.get("Uses") == "0":
                             leftover_files = None
                             if "DDSpath" in asset.attrib:
                                 files_to_delete = asset.attrib["DDSpath"].split(";")
                             files_to_delete.append(asset.attrib["DAEpath"])
-                            files_to_delete.append(re.sub(r'.dae', '.msh', asset.attrib["DAEpath"])) # Delete .msh
+                            files_to_delete.append(RE_DAE_EXT.sub('.msh', asset.attrib["DAEpath"])) # Delete .msh
 
                             # Clean up old .mat files (may cause running SOMA to crash) and uncomment following:
-                            #files_to_delete.append(re.sub(r'.dds', '.mat', files_to_delete[0])) # Delete .mat
+                            #files_to_delete.append(RE_DDS_EXT.sub('.mat', files_to_delete[0])) # Delete .mat
 
                             leftover_files = self.delete_assets(hpl3export, files_to_delete)
-                            self.asset_xml.remove(asset)
+                            self.retire_asset(asset)
                             if leftover_files:
+                                write_back()
                                 return
                         else:
                             asset.attrib["Uses"] = str(int(asset.attrib["Uses"]) - 1)
         for entry in entries_to_remove:
             objects.remove(entry) # Erase entry
+        write_back()
 
         return
 
     def clean_up(self):
-        if self.mapgroups:
-            for mapgroup in self.mapgroups:
-                for metamat in mapgroup.metamats:
-                    try:
-                        bpy.data.materials.remove(metamat.material)
-                    except (ReferenceError, TypeError) as e:
-                        pass
-                for idx, mi in mapgroup.metaimages.items():
-                    try:
-                        bpy.data.images.remove(mi.image)
-                    except (ReferenceError, TypeError) as e:
-                        pass
-                    try:
-                        bpy.data.images.remove(mi.microimage)
-                    except (ReferenceError, TypeError) as e:
-                        pass
+        materials = []
+        images = []
+        meshes = []
+        armatures = []
+        for mapgroup in self.mapgroups:
+            materials.extend(metamat.material for metamat in mapgroup.metamats)
+            for idx, mi in mapgroup.metaimages.items():
+                images.append(mi.image)
+                images.append(mi.microimage)
 
         if self.dupes:
             for obj in self.dupes:
                 try:
                     if type(obj.data) == bpy.types.Mesh:
                         print("removing ", obj.data.name)
-                        bpy.data.meshes.remove(obj.data, do_unlink=True)
+                        meshes.append(obj.data)
                     else:
-                        bpy.data.armatures.remove(obj.data, do_unlink=True)
-                except (ReferenceError, TypeError) as e:
+                        armatures.append(obj.data)
+                except ReferenceError:
                     pass
 
-        if self.mapgroups:
-            for mapgroup in self.mapgroups:
-                if mapgroup.metameshes:
-                    for mm in mapgroup.metameshes:
-                        try:
-                            bpy.data.meshes.remove(mm.mesh_original, do_unlink=True)
-                        except (ReferenceError, TypeError) as e:
-                            pass
-                        try:
-                            bpy.data.meshes.remove(mm.mesh_with_reset_uvs, do_unlink=True)
-                        except (ReferenceError, TypeError) as e:
-                            pass
-                        try:
-                            bpy.data.meshes.remove(mm.mesh_with_applied_modifiers, do_unlink=True)
-                        except (ReferenceError, TypeError) as e:
-                            pass
+        for mapgroup in self.mapgroups:
+            for mm in mapgroup.metameshes:
+                meshes.append(mm.mesh_original)
+                meshes.append(mm.mesh_with_reset_uvs)
+                meshes.append(mm.mesh_with_applied_modifiers)
+
+        remove_datablocks(bpy.data.materials, materials)
+        remove_datablocks(bpy.data.images, images)
+        remove_datablocks(bpy.data.meshes, meshes, do_unlink=True)
+        remove_datablocks(bpy.data.armatures, armatures, do_unlink=True)
 
         # Restore selection and delete custom properties
         if self.selected:
             for obj in self.selected:
-                try:
-                    del obj["hpl3export_obj_name"]
-                    del obj["hpl3export_mesh_name"]
-                    del obj["hpl3export_is_renderable"]
-                except KeyError:
-                    print("Could not delete all keys for '", obj.name, "'")
+                # Only exported meshes and armatures were given these
+                obj.pop("hpl3export_obj_name", None)
+                obj.pop("hpl3export_mesh_name", None)
                 obj.select_set(True)
 
 
@@ -2226,7 +2568,6 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
     def execute(self, context):
         hpl3export = context.scene.hpl3_export
         ParseError = ET.ParseError
-        os.system('cls')
         self.CONVERTERPATH = self.nvidiaGet()
         if self.CONVERTERPATH is None:
             error_msg = 'Nvidia tools not found, please place nvidia folder in blender addons.'
@@ -2241,7 +2582,7 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
         if hpl3export.map_file_path != "":
             if os.path.splitext(hpl3export.map_file_path)[1] == '.hpm':
                 try:
-                    self.root = ET.parse(map_file_path).getroot()
+                    self.root = read_xml(map_file_path)
                 except (IOError, ParseError):
                     error_msg = 'Map file could not be opened.'
                     self.report({'ERROR'}, "%s" % (error_msg))
@@ -2265,10 +2606,14 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
         asset_xml_path = self.mesh_export_path + "/exportscript_asset_tracking.xml"
 
         try:
-            self.asset_xml= ET.parse(asset_xml_path).getroot()
+            self.asset_xml= read_xml(asset_xml_path)
         except (IOError, ParseError):
             print("No asset use list found. Creating new")
             self.asset_xml = ET.Element("ExportedFiles")
+        # Index assets by path; first listing wins, as Windows paths ignore case
+        self.asset_by_dae = {}
+        for asset in self.asset_xml.iter("Asset"):
+            self.asset_by_dae.setdefault(asset.get("DAEpath", "").lower(), asset)
 
         print("File read success")
         export_num = 0
@@ -2277,8 +2622,8 @@ class OBJECT_OT_HPL3_Export (bpy.types.Operator):
         try:
             export_num = self.export_objects(hpl3export)
             if hpl3export.map_file_path != "":
-                ET.ElementTree(self.root).write(map_file_path)
-            ET.ElementTree(self.asset_xml).write(asset_xml_path)
+                write_xml(self.root, map_file_path)
+            write_xml(self.asset_xml, asset_xml_path)
         except Exception as e:
             print("\tEncountered an exception. Did not write to map file or xml tracking. Attempting cleanup")
             exception = e
@@ -2329,9 +2674,9 @@ class OBJECT_PT_HPL3_Export (Panel):
         obj_type_row.prop( hpl3export, "multi_mode", expand=True)
         if hpl3export.multi_mode == "SINGLE":
             if bpy.context.active_object.data is not None:
-                active_name_san = re.sub('[^0-9a-zA-Z]+', '_', bpy.context.active_object.data.name)
+                active_name_san = sanitize_name(bpy.context.active_object.data.name)
             else:
-                active_name_san = re.sub('[^0-9a-zA-Z]+', '_', bpy.context.active_object.name)
+                active_name_san = sanitize_name(bpy.context.active_object.name)
             layout.label(text="Export name: " + active_name_san + ".dae")
 
         layout.prop( hpl3export, "map_file_path")
@@ -2370,6 +2715,7 @@ class OBJECT_PT_HPL3_Export (Panel):
             bake_row_2 = col.row(align=True)
             bake_row_3 = col.row(align=True)
             bake_row_4 = col.row(align=True)
+            bake_row_5 = col.row(align=True)
             option_row_5 = col.row(align=True)
 
             multi_mat = hpl3export.bake_multi_mat_into_single == 'OP1'
@@ -2387,6 +2733,7 @@ class OBJECT_PT_HPL3_Export (Panel):
             else:
                 bake_row_3.prop( hpl3export, "disable_small_texture_workaround")
             bake_row_4.prop( hpl3export, "bake_scene_lighting")
+            bake_row_5.prop( hpl3export, "bake_device")
             option_row_5.prop( hpl3export, "sync_blender_deletions")
 
             if single_mat or multi_mat:
@@ -2399,8 +2746,10 @@ class OBJECT_PT_HPL3_Export (Panel):
                 bake_row_3.enabled = False
             if hpl3export.bake_multi_mat_into_single != 'OP3':
                 bake_row_4.enabled = True
+                bake_row_5.enabled = True
             else:
                 bake_row_4.enabled = False
+                bake_row_5.enabled = False
 
             option_row_5.enabled = obj_type_row.enabled
             if hpl3export.multi_mode != "MULTI":